@@ -0,0 +1,316 @@
+import os # For finding rotated logs and splitting logs into ranges
+import re # For stripping ports from a whole chunk at once
+import sys # For exiting on errors
+import gzip # For reading compressed rotated logs
+import json # For machine-readable reports
+import time # For formatting bucket times
+import calendar # For turning log times into seconds
+import argparse # For parsing command line options
+import multiprocessing # For analysing ranges of large logs in parallel
+from collections import Counter # For counting a chunk's lines in C
+
+# Streaming analyzer for server.log. Every line is "address:port<TAB>dd/mm/YYYY HH:MM:SS<TAB>COMMAND<TAB>OK|Error".
+# Logs are read in large chunks. Each chunk has its ports stripped by one regex pass and its lines
+# tallied by Counter, both in C, so Python only handles each distinct client, time, command and result
+# once per chunk rather than every line. Memory does not grow with the size of the log: seconds are only
+# held until they are folded into their interval, and only the heaviest clients are kept (see TopCounter).
+# Only the timeline grows, by one entry per interval the log covers.
+# Uncompressed logs are split into ranges that several processes analyse at once (--jobs).
+
+CHUNK_SIZE = 8 * 1024 * 1024 # Bytes read at a time
+RANGE_SIZE = 64 * 1024 * 1024 # Bytes of an uncompressed log given to each job
+PORT = re.compile(rb':\d+\t(?=\d\d/)') # The port ending a line's address, not the seconds ending its time
+SETTLE = 60 # Seconds a second stays open for lines logged slightly out of order, as workers share a log
+
+# Returns the log files to read for path, oldest first: path.N (or path.N.gz) down to path.1, then path
+def log_files(path, rotated=True):
+    files = []
+    if rotated:
+        directory = os.path.dirname(path) or '.'
+        name = os.path.basename(path)
+        pattern = re.compile(re.escape(name) + r'\.(\d+)(\.gz)?$')
+        for entry in os.listdir(directory):
+            match = pattern.match(entry)
+            if match:
+                files.append((int(match.group(1)), os.path.join(directory, entry)))
+        files.sort(reverse=True)
+    return [f for _, f in files] + ([path] if os.path.exists(path) else [])
+
+# Returns True if path is gzipped
+def is_gzipped(path):
+    with open(path, 'rb') as fh:
+        return fh.read(2) == b'\x1f\x8b'
+
+# Split logs into (path, start, end) ranges, in order. Compressed logs cannot be split so are one range each.
+def log_ranges(paths, range_size=RANGE_SIZE):
+    ranges = []
+    for path in paths:
+        size = None if is_gzipped(path) else os.path.getsize(path)
+        if not size:
+            ranges.append((path, 0, None))
+            continue
+        for start in range(0, size, range_size):
+            ranges.append((path, start, min(size, start + range_size)))
+    return ranges
+
+# Yields chunks of whole lines from a log, decompressing it if it is gzipped. With a range, only the
+# lines that start within [start, end) are read, so adjoining ranges never share a line.
+def read_chunks(path, start=0, end=None, chunk_size=CHUNK_SIZE):
+    fh = gzip.open(path, 'rb') if is_gzipped(path) else open(path, 'rb')
+    with fh:
+        if start:
+            fh.seek(start - 1)
+            fh.readline() # The rest of the line before start belongs to the previous range
+        while end is None or fh.tell() < end:
+            data = fh.read(chunk_size if end is None else min(chunk_size, end - fh.tell()))
+            if not data:
+                break
+            if not data.endswith(b'\n'):
+                data += fh.readline() # Finish the last line
+            if not data.endswith(b'\n'):
+                data += b'\n' # Last line of a log still being written may lack its newline
+            yield data
+
+# Approximate counter of the heaviest keys in bounded memory. Counts are exact until more than
+# 2 * capacity keys are held, then only the top capacity are kept. A key pruned and seen again
+# restarts from zero, so counts may be low by at most floor, the largest count ever pruned.
+class TopCounter:
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.floor = 0 # Largest count dropped so far
+
+    def update(self, counts, floor=0):
+        self.counts.update(counts)
+        self.floor = max(self.floor, floor)
+        if len(self.counts) > 2 * self.capacity:
+            ranked = self.counts.most_common()
+            self.floor = max(self.floor, ranked[self.capacity][1])
+            self.counts = Counter(dict(ranked[:self.capacity]))
+
+    def most_common(self, n):
+        return self.counts.most_common(n)
+
+class LogAnalyzer:
+    def __init__(self, interval=60, max_clients=100000):
+        self.interval = interval # Seconds per timeline bucket
+        self.lines = 0 # Every line read, parsed or not
+        self.requests = 0 # Lines parsed
+        self.errors = 0
+        self.commands = Counter() # (command, failed) -> requests
+        self.clients = TopCounter(max_clients) # Address -> requests
+        self.client_errors = TopCounter(max_clients) # Address -> failed requests
+        self.timeline = {} # Interval start -> [requests, errors, busiest second's requests]
+        self.open_seconds = Counter() # Second -> requests, for seconds that may still see more lines
+        self.stamps = {} # Log time -> seconds, as a second's lines all share it
+        self.first = None # Earliest second seen
+        self.last = None # Latest second seen
+        self.partial = False # Reading a range that starts part way into a log
+        self.files = []
+
+    # Returns the time in seconds of a log time, or None if it is not one. Log times are local, but they
+    # are treated as UTC throughout so buckets line up with what the log says.
+    def _seconds(self, stamp):
+        seconds = self.stamps.get(stamp)
+        if seconds is None:
+            try:
+                if not len(stamp) == 19:
+                    return None
+                seconds = calendar.timegm((int(stamp[6:10]), int(stamp[3:5]), int(stamp[0:2]),
+                                           int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19])))
+            except ValueError:
+                return None
+            if len(self.stamps) > 4096: # A chunk only spans a few seconds, so old ones are not needed again
+                self.stamps.clear()
+            self.stamps[stamp] = seconds
+        return seconds
+
+    # Tally one chunk of log lines
+    def add_chunk(self, chunk):
+        lines = PORT.sub(b'\t', chunk).split(b'\n')
+        lines.pop() # Chunks end with a newline
+        self.lines += len(lines)
+        clients = Counter()
+        client_errors = Counter()
+        rests = Counter() # Line without its address -> requests
+        # Count in C, then handle each distinct line in Python. Lines only differ by client and time,
+        # and a chunk spans few seconds, so splitting off the address leaves very few distinct rests.
+        for line, count in Counter(lines).items():
+            address, _, rest = line.partition(b'\t')
+            if not rest.count(b'\t') == 2:
+                continue
+            clients[address] += count
+            if not rest.endswith(b'\tOK'):
+                client_errors[address] += count
+            rests[rest] += count
+        self.clients.update(clients)
+        self.client_errors.update(client_errors)
+
+        keys = Counter() # (second, command, failed) -> requests
+        for rest, count in rests.items():
+            stamp, command, result = rest.split(b'\t')
+            seconds = self._seconds(stamp)
+            if seconds is None:
+                continue
+            keys[(seconds, command, not result == b'OK')] += count
+        for (seconds, command, failed), count in keys.items():
+            self.requests += count
+            self.commands[(command, failed)] += count
+            self.open_seconds[seconds] += count
+            bucket = self.timeline.setdefault(seconds - seconds % self.interval, [0, 0, 0])
+            bucket[0] += count
+            if failed:
+                bucket[1] += count
+                self.errors += count
+            if self.first is None or seconds < self.first:
+                self.first = seconds
+            if self.last is None or seconds > self.last:
+                self.last = seconds
+        if self.last is not None:
+            self._settle(self.last - SETTLE)
+
+    # Fold every open second before until into its interval's busiest second. When reading a range, the
+    # first seconds may continue from the range before, so they are left for the merge to settle.
+    def _settle(self, until):
+        keep = self.first + SETTLE if self.partial else None
+        for seconds in list(self.open_seconds):
+            if until is not None and (seconds >= until or keep is not None and seconds < keep):
+                continue
+            count = self.open_seconds.pop(seconds)
+            bucket = self.timeline[seconds - seconds % self.interval]
+            bucket[2] = max(bucket[2], count)
+
+    # Tally a log, or the lines starting within [start, end) of it
+    def add_file(self, path, start=0, end=None):
+        self.partial = start > 0
+        for chunk in read_chunks(path, start, end):
+            self.add_chunk(chunk)
+        self.partial = False
+
+    # Fold in the tallies of an analyzer that read the following part of the logs
+    def merge(self, other):
+        self.lines += other.lines
+        self.requests += other.requests
+        self.errors += other.errors
+        self.commands.update(other.commands)
+        self.clients.update(other.clients.counts, other.clients.floor)
+        self.client_errors.update(other.client_errors.counts, other.client_errors.floor)
+        for start, (requests, errors, peak) in other.timeline.items():
+            bucket = self.timeline.setdefault(start, [0, 0, 0])
+            bucket[0] += requests
+            bucket[1] += errors
+            bucket[2] = max(bucket[2], peak)
+        self.open_seconds.update(other.open_seconds) # Seconds either side of a range boundary may be split across both
+        if other.first is not None:
+            self.first = other.first if self.first is None else min(self.first, other.first)
+            self.last = other.last if self.last is None else max(self.last, other.last)
+            self._settle(self.last - SETTLE)
+
+    # Returns the report as a dict
+    def report(self, top=10):
+        self._settle(None)
+        span = self.last - self.first + 1 if self.requests else 0
+        rate = lambda part, whole: round(part / whole * 100, 2) if whole else 0.0
+        stamp = lambda seconds: time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
+        commands = {}
+        for (command, failed), count in self.commands.items():
+            entry = commands.setdefault(command.decode(errors='replace'), {"REQUESTS": 0, "ERRORS": 0})
+            entry["REQUESTS"] += count
+            entry["ERRORS"] += count if failed else 0
+        for entry in commands.values():
+            entry["SHARE_PCT"] = rate(entry["REQUESTS"], self.requests)
+            entry["ERROR_PCT"] = rate(entry["ERRORS"], entry["REQUESTS"])
+        return {
+            "FILES": self.files,
+            "LINES": self.lines,
+            "MALFORMED": self.lines - self.requests,
+            "REQUESTS": self.requests,
+            "ERRORS": self.errors,
+            "ERROR_PCT": rate(self.errors, self.requests),
+            "FIRST": stamp(self.first) if self.requests else None,
+            "LAST": stamp(self.last) if self.requests else None,
+            "MEAN_RPS": round(self.requests / span, 3) if span else 0.0,
+            "PEAK_RPS": max((bucket[2] for bucket in self.timeline.values()), default=0),
+            "COMMANDS": dict(sorted(commands.items(), key=lambda item: -item[1]["REQUESTS"])),
+            "TOP_CLIENTS": [{"CLIENT": address.decode(errors='replace'), "REQUESTS": count, "ERRORS": self.client_errors.counts.get(address, 0),
+                             "SHARE_PCT": rate(count, self.requests)} for address, count in self.clients.most_common(top)],
+            "CLIENTS_APPROXIMATE": self.clients.floor > 0,
+            "INTERVAL_S": self.interval,
+            "TIMELINE": [{"START": stamp(start), "REQUESTS": requests, "RPS": round(requests / self.interval, 3), "PEAK_RPS": peak,
+                          "ERRORS": errors, "ERROR_PCT": rate(errors, requests)}
+                         for start, (requests, errors, peak) in sorted(self.timeline.items())],
+        }
+
+# Analyse one range of a log in a job process. Returns the analyzer with its tallies.
+def analyze_range(args):
+    path, start, end, interval, max_clients = args
+    analyzer = LogAnalyzer(interval, max_clients)
+    analyzer.add_file(path, start, end)
+    analyzer.stamps = {} # Not needed by the parent, so not worth sending back
+    return analyzer
+
+# Print a report as plain text tables
+def print_report(report):
+    print(f"Files:\t\t{', '.join(report['FILES'])}")
+    print(f"Lines:\t\t{report['LINES']} ({report['MALFORMED']} malformed)")
+    print(f"Period:\t\t{report['FIRST']} to {report['LAST']}")
+    print(f"Requests:\t{report['REQUESTS']}, {report['MEAN_RPS']}/s on average, {report['PEAK_RPS']}/s at peak")
+    print(f"Errors:\t\t{report['ERRORS']} ({report['ERROR_PCT']}%)")
+
+    print("\nCommand mix:")
+    print(f"  {'COMMAND':<16}{'REQUESTS':>12}{'SHARE':>9}{'ERRORS':>10}{'ERROR %':>9}")
+    for command, entry in report["COMMANDS"].items():
+        print(f"  {command:<16}{entry['REQUESTS']:>12}{entry['SHARE_PCT']:>8}%{entry['ERRORS']:>10}{entry['ERROR_PCT']:>8}%")
+
+    print(f"\nTop clients{' (approximate)' if report['CLIENTS_APPROXIMATE'] else ''}:")
+    print(f"  {'CLIENT':<40}{'REQUESTS':>12}{'SHARE':>9}{'ERRORS':>10}")
+    for client in report["TOP_CLIENTS"]:
+        print(f"  {client['CLIENT']:<40}{client['REQUESTS']:>12}{client['SHARE_PCT']:>8}%{client['ERRORS']:>10}")
+
+    print(f"\nRequests per {report['INTERVAL_S']}s:")
+    print(f"  {'START':<21}{'REQUESTS':>10}{'RPS':>10}{'PEAK RPS':>10}{'ERRORS':>8}{'ERROR %':>9}")
+    for bucket in report["TIMELINE"]:
+        print(f"  {bucket['START']:<21}{bucket['REQUESTS']:>10}{bucket['RPS']:>10}{bucket['PEAK_RPS']:>10}{bucket['ERRORS']:>8}{bucket['ERROR_PCT']:>8}%")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarise a message board server log.")
+    parser.add_argument("logs", nargs='*', default=["server.log"], help="Logs to read. Rotated copies of each are read too (default: server.log)")
+    parser.add_argument("--no-rotated", action="store_true", help="Only read the named logs, not their rotated copies")
+    parser.add_argument("--interval", type=int, default=60, help="Seconds per timeline bucket (default: 60)")
+    parser.add_argument("--top", type=int, default=10, help="Number of top clients to show (default: 10)")
+    parser.add_argument("--max-clients", type=int, default=100000, help="Clients tracked exactly before counts become approximate (default: 100000)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Processes analysing the logs at once (default: one per CPU)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    if args.interval < 1:
+        parser.error("--interval must be at least 1")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    paths = [f for log in args.logs for f in log_files(log, not args.no_rotated)]
+    if not paths:
+        print(f"ERROR:\tNo logs found at {', '.join(args.logs)}.")
+        sys.exit(1)
+
+    analyzer = LogAnalyzer(args.interval, args.max_clients)
+    try:
+        if args.jobs == 1:
+            for path in paths:
+                analyzer.add_file(path)
+        else:
+            # Ranges are merged in order so seconds are settled the same way as reading straight through
+            jobs = [(path, start, end, args.interval, args.max_clients) for path, start, end in log_ranges(paths)]
+            with multiprocessing.Pool(min(args.jobs, len(jobs))) as pool:
+                for part in pool.imap(analyze_range, jobs):
+                    analyzer.merge(part)
+    except Exception as e:
+        print("ERROR:\tFailed to read logs")
+        print(e)
+        sys.exit(1)
+    analyzer.files = paths
+    report = analyzer.report(args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
@@ -0,0 +1,250 @@
+import sys # For finding the python interpreter
+import os # For building synthetic boards
+import time # For timing requests
+import json # For machine-readable results
+import random # For choosing commands from the mix
+import socket # For finding a free port and waiting for the server
+import argparse # For parsing command line options
+import tempfile # For holding synthetic boards
+import threading # For driving requests concurrently
+import subprocess # For spawning a local server
+import contextlib # For keeping progress and client errors off stdout
+import client # Requests are sent exactly as the real client sends them
+import storage # For converting synthetic boards to segments
+
+# Load generator for the board protocol. Drives a weighted mix of commands at a fixed concurrency
+# against a server (optionally spawning one over synthetic boards) and prints throughput and
+# latency percentiles per command as JSON.
+
+# Parse a mix such as "GET_BOARDS=1,GET_MESSAGES=8,POST_MESSAGE=1" into a dict of weights
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        command, _, weight = part.partition('=')
+        command = command.strip().upper()
+        if not command in ("GET_BOARDS", "GET_MESSAGES", "POST_MESSAGE"):
+            raise argparse.ArgumentTypeError(f"Unknown command '{command}' in mix")
+        weights[command] = float(weight or 1)
+    return weights
+
+# Write nb_boards boards of nb_messages messages of message_size bytes in the board/ layout
+def generate_boards(root, nb_boards, nb_messages, message_size):
+    start = time.time() - nb_messages # One message per second, ending now
+    for b in range(nb_boards):
+        path = os.path.join(root, f"Bench_Board_{b}")
+        os.makedirs(path)
+        for m in range(nb_messages):
+            file_time = time.strftime("%Y%m%d-%H%M%S", time.localtime(start + m))
+            with open(os.path.join(path, f"{file_time}-Message_{m}"), 'w') as fh:
+                fh.write('x' * message_size)
+
+# Returns a port nothing is listening on
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+# Start server.py on port over board_dir and wait until it accepts connections
+def spawn_server(port, board_dir, server_args):
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    command = [sys.executable, server_path, "127.0.0.1", str(port), "--board-dir", board_dir] + server_args
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Server failed to start: {' '.join(command)}")
+
+# Returns the p-th percentile (0-100) of sorted values by nearest rank
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+# Summarise a list of latencies in seconds as milliseconds
+def summarise(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        "REQUESTS": len(latencies),
+        "ERRORS": errors,
+        "THROUGHPUT": len(latencies) / elapsed if elapsed else 0,
+        "MEAN_MS": sum(latencies) / len(latencies) * 1000 if latencies else None,
+        "P50_MS": percentile(latencies, 50) * 1000 if latencies else None,
+        "P95_MS": percentile(latencies, 95) * 1000 if latencies else None,
+        "P99_MS": percentile(latencies, 99) * 1000 if latencies else None,
+        "MAX_MS": latencies[-1] * 1000 if latencies else None,
+    }
+
+# One load generating thread. Sends requests until the deadline or until it has sent its share.
+class BenchWorker(threading.Thread):
+    def __init__(self, host, port, boards, weights, deadline, nb_requests, persistent, framed, seed, encodings=("json",), compression=()):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.boards = boards # Board names to read from and post to
+        self.commands = list(weights)
+        self.weights = list(weights.values())
+        self.deadline = deadline
+        self.nb_requests = nb_requests # None to run until the deadline
+        self.persistent = persistent # Keep one connection open for every request
+        self.framed = framed or persistent # Persistent connections need framing
+        self.encodings = encodings # Encodings to offer in HELLO. JSON only skips negotiating.
+        self.compression = compression # Compression to offer in HELLO
+        self.random = random.Random(seed)
+        self.latencies = {command: [] for command in weights}
+        self.errors = {command: 0 for command in weights}
+
+    # Choose the next command and its parameters
+    def _next_request(self):
+        command = self.random.choices(self.commands, self.weights)[0]
+        if command == "GET_BOARDS":
+            return command, []
+        board = self.random.choice(self.boards)
+        if command == "GET_MESSAGES":
+            return command, [board]
+        return command, [board, f"bench {self.random.randrange(1 << 30)}", "benchmark message body"]
+
+    def run(self):
+        client_socket = None
+        codec = None
+        sent = 0
+        while time.time() < self.deadline and (self.nb_requests is None or sent < self.nb_requests):
+            command, params = self._next_request()
+            sent += 1
+            start = time.perf_counter()
+            try:
+                if not client_socket:
+                    client_socket = client.connect(self.host, self.port)
+                    codec = None
+                    if client_socket and self.framed and (self.encodings != ("json",) or self.compression):
+                        codec = client.negotiate(client_socket, self.encodings, self.compression)
+                response = client.send_request(command, client_socket, params, self.framed, codec) if client_socket else None
+            except Exception:
+                response = None
+            if not self.persistent or not type(response) == dict:
+                if client_socket:
+                    client_socket.close()
+                client_socket = None
+            elapsed = time.perf_counter() - start
+
+            if type(response) == dict and response.get("CODE") == "SUCCESS":
+                self.latencies[command].append(elapsed)
+            else:
+                self.errors[command] += 1
+        if client_socket:
+            client_socket.close()
+
+# Run the benchmark and return the results dict
+def run_benchmark(host, port, boards, weights, concurrency, duration, nb_requests, persistent, framed, encodings=("json",), compression=()):
+    deadline = time.time() + duration
+    share = None if nb_requests is None else -(-nb_requests // concurrency) # Ceiling division
+    workers = [BenchWorker(host, port, boards, weights, deadline, share, persistent, framed, seed, encodings, compression)
+               for seed in range(concurrency)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    results = {"ELAPSED_S": elapsed, "COMMANDS": {}}
+    all_latencies = []
+    all_errors = 0
+    for command in weights:
+        latencies = [l for worker in workers for l in worker.latencies[command]]
+        errors = sum(worker.errors[command] for worker in workers)
+        results["COMMANDS"][command] = summarise(list(latencies), errors, elapsed)
+        all_latencies += latencies
+        all_errors += errors
+    results["TOTAL"] = summarise(all_latencies, all_errors, elapsed)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark a message board server.")
+    parser.add_argument("--host", default="127.0.0.1", help="Server to benchmark (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="Port of the server to benchmark. Required unless --spawn is used")
+    parser.add_argument("--spawn", action="store_true", help="Start a local server over synthetic boards and benchmark it")
+    parser.add_argument("--server-args", default="--no-log", help="Extra arguments for the spawned server (default: --no-log)")
+    parser.add_argument("--storage", choices=["file", "segment"], default="file", help="Storage of the synthetic boards (default: file)")
+    parser.add_argument("--boards", type=int, default=4, help="Number of synthetic boards (default: 4)")
+    parser.add_argument("--messages", type=int, default=1000, help="Messages per synthetic board (default: 1000)")
+    parser.add_argument("--message-size", type=int, default=200, help="Bytes per synthetic message (default: 200)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("GET_BOARDS=1,GET_MESSAGES=8,POST_MESSAGE=1"),
+                        help="Weighted command mix (default: GET_BOARDS=1,GET_MESSAGES=8,POST_MESSAGE=1)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of concurrent clients (default: 16)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run for (default: 10)")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests instead of running for --duration")
+    parser.add_argument("--persistent", action="store_true", help="Reuse one framed connection per client")
+    parser.add_argument("--legacy", action="store_true", help="Send unframed requests, one connection each. Responses over 4096 bytes fail")
+    parser.add_argument("--encoding", choices=["json", "binary"], default="json", help="Encoding to negotiate on framed connections (default: json)")
+    parser.add_argument("--compress", action="store_true", help="Negotiate zlib compression of large frames")
+    parser.add_argument("--output", help="Write the JSON results to this file as well as stdout")
+    args = parser.parse_args()
+
+    if not args.spawn and args.port is None:
+        parser.error("--port is required unless --spawn is used")
+    if args.persistent and args.legacy:
+        parser.error("--persistent needs framing so cannot be used with --legacy")
+    if args.legacy and (args.encoding == "binary" or args.compress):
+        parser.error("--encoding and --compress need framing so cannot be used with --legacy")
+
+    process = None
+    board_dir = None
+    try:
+        # Only the JSON results go to stdout. Anything printed along the way goes to stderr.
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.spawn:
+                board_dir = tempfile.TemporaryDirectory(prefix="bench-boards-")
+                file_root = os.path.join(board_dir.name, "board")
+                generate_boards(file_root, args.boards, args.messages, args.message_size)
+                server_root = file_root
+                server_args = args.server_args.split()
+                if args.storage == "segment":
+                    server_root = os.path.join(board_dir.name, "segments")
+                    storage.migrate(file_root, server_root)
+                    server_args += ["--storage", "segment"]
+                args.port = free_port()
+                process = spawn_server(args.port, server_root, server_args)
+
+            # Find the boards to use from the server itself, in the encoding the workers use
+            client_socket = client.connect(args.host, args.port)
+            codec = None
+            if client_socket and args.encoding == "binary":
+                codec = client.negotiate(client_socket, (args.encoding,), ())
+            response = client.send_request("GET_BOARDS", client_socket, framed=not args.legacy, codec=codec) if client_socket else None
+            if client_socket:
+                client_socket.close()
+            if not type(response) == dict or not response.get("BOARDS"):
+                print("ERROR:\tCould not get the list of boards from the server.")
+                sys.exit(1)
+
+            results = run_benchmark(args.host, args.port, response["BOARDS"], args.mix, args.concurrency,
+                                    float('inf') if args.requests else args.duration, args.requests, args.persistent, not args.legacy,
+                                    (args.encoding,), ("zlib",) if args.compress else ())
+            results["CONFIG"] = {
+                "HOST": args.host, "PORT": args.port, "SPAWNED": args.spawn, "SERVER_ARGS": args.server_args if args.spawn else None,
+                "STORAGE": args.storage if args.spawn else None, "BOARDS": len(response["BOARDS"]),
+                "MESSAGES_PER_BOARD": args.messages if args.spawn else None, "MESSAGE_SIZE": args.message_size if args.spawn else None,
+                "MIX": args.mix, "CONCURRENCY": args.concurrency, "PERSISTENT": args.persistent, "LEGACY": args.legacy,
+                "ENCODING": args.encoding, "COMPRESS": args.compress,
+            }
+
+        output = json.dumps(results, indent=2)
+        print(output)
+        if args.output:
+            with open(args.output, 'w') as fh:
+                fh.write(output + '\n')
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        if board_dir:
+            board_dir.cleanup()
@@ -1,30 +1,36 @@
 import socket # For socket programming
 import sys # For getting system arguments
 import json # For encoding messages
-
-# Encodes command and parameters then sends. Then waits for response.
-def send_request(command, client_socket, params=[]):
+import time # For backing off between retries
+import threading # For the connection pool and concurrent fetches
+import select # For checking idle pooled connections
+import asyncio # For the asyncio client
+import protocol # Length-prefixed framing shared with the server
+
+# Builds the request dict for a command and its parameters. Returns an error code string if invalid.
+# raw sends text exactly as given, for connections using the binary encoding.
+def build_request(command, params=[], raw=False):
     nb_params = len(params)
     request = {}
 
-    # Sending Request
-    # Before sending, we will convert to json then encode further
     if command == "GET_BOARDS":
         if not nb_params == 0:
             print(f"ERROR:\t\tInvalid invalid number of parameters. Expected 0, got {nb_params}")
             return "INVALID_NB_PARAM"
-        
+
         request["COMMAND"] = "GET_BOARDS" # Command parameter
-        client_socket.send(json.dumps(request).encode())
 
     elif command == "GET_MESSAGES":
-        if not nb_params == 1:
-            print(f"ERROR:\t\tInvalid invalid number of parameters. Expected 1, got {nb_params}")
+        if not nb_params in (1, 2):
+            print(f"ERROR:\t\tInvalid invalid number of parameters. Expected 1 or 2, got {nb_params}")
             return "INVALID_NB_PARAM"
 
         request["COMMAND"] = "GET_MESSAGES" # Command parameter
         request["BOARD"] = params[0] # Board name to get parameter
-        client_socket.send(json.dumps(request).encode())
+        if nb_params == 2: # Optional dict of paging fields: LIMIT, BEFORE (a CURSOR) and SINCE (a LATEST)
+            for field in ("LIMIT", "BEFORE", "SINCE"):
+                if params[1].get(field) is not None:
+                    request[field] = params[1][field]
 
     elif command == "POST_MESSAGE":
         if not nb_params == 3:
@@ -32,28 +38,197 @@ def send_request(command, client_socket, params=[]):
             return "INVALID_NB_PARAM"
         request["COMMAND"] = command # Command parameter
         request["BOARD"] = params[0] # Board name to write to parameter
-        request["TITLE"] = params[1].replace(' ', '_') # Message title parameter
-        request["MESSAGE"] = params[2].replace(' ', '_') # Message body parameter
+        request["TITLE"] = params[1] if raw else params[1].replace(' ', '_') # Message title parameter
+        request["MESSAGE"] = params[2] if raw else params[2].replace(' ', '_') # Message body parameter
+
+    elif command == "POST_MESSAGES":
+        if not nb_params >= 1:
+            print(f"ERROR:\t\tInvalid invalid number of parameters. Expected at least 1, got {nb_params}")
+            return "INVALID_NB_PARAM"
+
+        request["COMMAND"] = command # Command parameter
+        # One (board, title, body) parameter per message
+        request["MESSAGES"] = [[board, title, body] if raw else [board, title.replace(' ', '_'), body.replace(' ', '_')]
+                               for board, title, body in params]
+
+    elif command == "SEARCH":
+        if not nb_params in (1, 2):
+            print(f"ERROR:\t\tInvalid invalid number of parameters. Expected 1 or 2, got {nb_params}")
+            return "INVALID_NB_PARAM"
+
+        request["COMMAND"] = "SEARCH" # Command parameter
+        request["QUERY"] = params[0] # Words every result must contain
+        if nb_params == 2: # Optional dict of BOARD to search just one board and LIMIT
+            for field in ("BOARD", "LIMIT"):
+                if params[1].get(field) is not None:
+                    request[field] = params[1][field]
+
+    elif command == "CREATE_BOARD":
+        if not nb_params in (1, 2):
+            print(f"ERROR:\t\tInvalid invalid number of parameters. Expected 1 or 2, got {nb_params}")
+            return "INVALID_NB_PARAM"
+
+        request["COMMAND"] = "CREATE_BOARD" # Command parameter
+        request["BOARD"] = params[0] if raw else params[0].replace(' ', '_') # Name of the new board
+        if nb_params == 2 and params[1]: # Admin token, if the server requires one
+            request["TOKEN"] = params[1]
+
+    elif command == "SUBSCRIBE":
+        if not nb_params >= 1:
+            print(f"ERROR:\t\tInvalid invalid number of parameters. Expected at least 1, got {nb_params}")
+            return "INVALID_NB_PARAM"
+
+        request["COMMAND"] = "SUBSCRIBE" # Command parameter
+        request["BOARDS"] = list(params) # Board names to be sent new posts from
+
+    elif command == "GET_STATS":
+        if not nb_params == 0:
+            print(f"ERROR:\t\tInvalid invalid number of parameters. Expected 0, got {nb_params}")
+            return "INVALID_NB_PARAM"
+
+        request["COMMAND"] = "GET_STATS" # Command parameter
 
-        client_socket.send(json.dumps(request).encode())
     else: # Unknown command, do not send anything.
         print(f"ERROR:\t\tUnknown command '{command}'")
         return "UNKNOWN_COMMAND"
 
-    # Await and then handle response
+    return request
+
+# Encodes command and parameters then sends. Then waits for response.
+# If framed is True the request is length-prefixed and the socket stays usable for further requests.
+# codec is the one negotiated for the connection, if any, and implies framed.
+def send_request(command, client_socket, params=[], framed=False, codec=None):
+    request = build_request(command, params, raw=is_raw(codec))
+    if not type(request) == dict:
+        return request
+
+    # Sending Request
+    # Before sending, we will convert to json then encode further
     try:
-        response = json.loads(client_socket.recv(4096).decode()) # Decode in same way as before
+        if framed or codec:
+            protocol.send_frame(client_socket, request, codec)
+            response = protocol.recv_frame(client_socket, codec)
+        else:
+            client_socket.send(json.dumps(request).encode())
+            # Await and then handle response
+            response = json.loads(client_socket.recv(4096).decode()) # Decode in same way as before
     except socket.timeout:
         print("ERROR:\tConnection timed out after 10 seconds.")
         return "CONNECTION_TIMEOUT"
+    except (ConnectionError, protocol.FrameError):
+        print("ERROR:\tConnection closed by server.")
+        return "CONNECTION_CLOSED"
     except:
         raise
 
+    if response is None: # Server closed a framed connection
+        print("ERROR:\tConnection closed by server.")
+        return "CONNECTION_CLOSED"
+
     # close socket in calling function
     return response
 
+# Pipelines several (command, params) requests down one framed connection.
+# All requests are sent before any response is read. Returns the list of responses in order.
+def send_requests(requests, client_socket, codec=None):
+    frames = []
+    for command, params in requests:
+        request = build_request(command, params, raw=is_raw(codec))
+        if not type(request) == dict:
+            return request
+        frames.append(protocol.encode_frame(request, codec))
+
+    responses = []
+    try:
+        client_socket.sendall(b''.join(frames))
+        for _ in frames:
+            response = protocol.recv_frame(client_socket, codec)
+            if response is None:
+                print("ERROR:\tConnection closed by server.")
+                return "CONNECTION_CLOSED"
+            responses.append(response)
+    except socket.timeout:
+        print("ERROR:\tConnection timed out after 10 seconds.")
+        return "CONNECTION_TIMEOUT"
+    except (ConnectionError, protocol.FrameError):
+        print("ERROR:\tConnection closed by server.")
+        return "CONNECTION_CLOSED"
+
+    return responses
+
+# Subscribe to boards on a framed connection and yield every post pushed to them as a
+# (board, title, contents) tuple, until the server closes the connection. The connection cannot be
+# used for anything else afterwards. Returns an error code string in place of the first post if
+# subscribing failed.
+def subscribe(client_socket, boards, codec=None):
+    response = send_request("SUBSCRIBE", client_socket, boards, framed=True, codec=codec)
+    if not type(response) == dict:
+        yield response
+        return
+    if not response["CODE"] == "SUCCESS":
+        print(f"ERROR:\t{response['ERROR_MESSAGE']}")
+        yield "SUBSCRIBE_FAIL"
+        return
+
+    client_socket.settimeout(None) # Posts may be a long time apart. The server sends heartbeats.
+    while True:
+        try:
+            event = protocol.recv_frame(client_socket, codec)
+        except (ConnectionError, protocol.FrameError):
+            event = None
+        if event is None:
+            print("ERROR:\tSubscription closed by server.")
+            return
+        if event.get("EVENT") == "MESSAGE":
+            yield (event["BOARD"], *event["MESSAGE"])
+
+# Returns True if text goes over a connection using codec exactly as written, without underscores for spaces
+def is_raw(codec):
+    return codec is not None and codec.encoding == "binary"
+
+# Ask the server for the most compact encoding and compression it shares with us on a framed connection.
+# Returns the Codec to use for every later request, or an error code string.
+def negotiate(client_socket, encodings=protocol.Codec.ENCODINGS, compression=protocol.Codec.COMPRESSIONS):
+    try:
+        protocol.send_frame(client_socket, {"COMMAND": "HELLO", "ENCODINGS": list(encodings), "COMPRESSION": list(compression)})
+        response = protocol.recv_frame(client_socket)
+    except socket.timeout:
+        print("ERROR:\tConnection timed out after 10 seconds.")
+        return "CONNECTION_TIMEOUT"
+    except (ConnectionError, protocol.FrameError):
+        print("ERROR:\tConnection closed by server.")
+        return "CONNECTION_CLOSED"
+
+    if response is None:
+        print("ERROR:\tConnection closed by server.")
+        return "CONNECTION_CLOSED"
+    if not response.get("CODE") == "SUCCESS": # Servers from before HELLO only speak JSON
+        return protocol.Codec()
+    return protocol.Codec(response["ENCODING"], response["COMPRESSION"])
+
+# Sends a framed request over a persistent connection, reconnecting once if the server has closed it.
+# A new connection negotiates its encoding again. Returns the response, the socket and the codec to
+# use for the next request.
+def persistent_request(command, client_socket, server_ip, server_port, params=[], codec=None):
+    if client_socket:
+        response = send_request(command, client_socket, params, framed=True, codec=codec)
+        if not response == "CONNECTION_CLOSED":
+            return response, client_socket, codec
+        client_socket.close()
+
+    client_socket = connect(server_ip, server_port) # Attempt to (re)connect to server
+    if not client_socket:
+        return "NO_CONNECTION", None, codec
+    codec = negotiate(client_socket)
+    if not isinstance(codec, protocol.Codec):
+        client_socket.close()
+        return codec, None, None
+    return send_request(command, client_socket, params, framed=True, codec=codec), client_socket, codec
+
 # This function should handle the results of all responses. including printing
-def handle_response(command, response):
+# raw is True when the response came over a binary connection, so text needs no unescaping.
+def handle_response(command, response, raw=False):
+    text = (lambda t: t) if raw else (lambda t: t.replace('_', ' '))
 
     if not response["CODE"] == "SUCCESS":
         print("ERROR:\tAn error occured while handling the request")
@@ -63,7 +238,7 @@ def handle_response(command, response):
     if command == "GET_BOARDS": # Handles response to GET_BOARDS, printing board names nicely
         if len(response["BOARDS"]):
             print("Available Boards:")
-            print('\n'.join(f"\t{i+1}. {b.replace('_', ' ')}" for i, b in enumerate(response["BOARDS"])))
+            print('\n'.join(f"\t{i+1}. {text(b)}" for i, b in enumerate(response["BOARDS"])))
         else:
             print("No Boards to Display..")
             return
@@ -74,12 +249,26 @@ def handle_response(command, response):
 
     elif command == "GET_MESSAGES": # Handles response to GET_MESSAGES, printing messages nicely
         if len(response["MESSAGES"]):
-            print('\n'.join(f"{m[0].replace('_', ' ')}:\n\t{m[1].replace('_', ' ')}" for m in response["MESSAGES"]))
+            print('\n'.join(f"{text(m[0])}:\n\t{text(m[1])}" for m in response["MESSAGES"]))
         else:
             print("No Messages to Display..")
 
     elif command == "POST_MESSAGE": # Simply informs the user the message was posted successfully.
         print("Successfully posted message to board.")
+    elif command == "POST_MESSAGES": # Summarises how many of the messages were posted
+        failed = [i for i, result in enumerate(response["RESULTS"]) if not result["CODE"] == "SUCCESS"]
+        print(f"Successfully posted {len(response['RESULTS']) - len(failed)} of {len(response['RESULTS'])} messages.")
+        for i in failed:
+            print(f"ERROR:\tMessage {i + 1}: {response['RESULTS'][i]['ERROR_MESSAGE']}")
+    elif command == "CREATE_BOARD": # Simply informs the user the board was created
+        print(f"Successfully created board {text(response['BOARD'])}.")
+    elif command == "SEARCH": # Handles response to SEARCH, printing matches with their board
+        if len(response["RESULTS"]):
+            print('\n'.join(f"[{text(r[0])}] {text(r[1])}:\n\t{text(r[2])}" for r in response["RESULTS"]))
+        else:
+            print("No Matching Messages..")
+    elif command == "GET_STATS": # Prints the server's metrics as indented JSON
+        print(json.dumps(response["STATS"], indent=2))
     else: # Unknown response command, so just discard.
         print("ERROR:\tUnknown command.")
         
@@ -106,6 +295,481 @@ def connect(server_ip, server_port):
 
     return client_socket
 
+# Importable client API. BoardClient (blocking) and AsyncBoardClient (asyncio) keep a pool of framed
+# connections that have already negotiated their encoding, apply a timeout to every request, retry
+# requests that failed on the connection or were refused by the server's limits, and can fetch every
+# board at once with fetch_all_boards. Text is always returned with real spaces whatever the encoding.
+# Failures are raised as ClientError rather than printed.
+
+# Commands that are safe to send again if the connection failed after they were sent
+IDEMPOTENT = ("GET_BOARDS", "GET_MESSAGES", "SEARCH", "GET_STATS")
+# Error codes of requests the server refused without acting on them, so they can always be retried
+REFUSED = ("SERVER_BUSY", "RATE_LIMITED")
+
+class ClientError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(f"{code}: {message}" if message else code)
+        self.code = code # Error code from the server's response, or a connection failure code
+        self.response = None # The failed response, if there was one
+
+# Returns the HELLO request offering encodings and compression
+def _hello(encodings, compression):
+    return {"COMMAND": "HELLO", "ENCODINGS": list(encodings), "COMPRESSION": list(compression)}
+
+# Returns the Codec a HELLO response agrees on. Servers from before HELLO fail it and only speak JSON.
+def _agreed(response):
+    if response is None:
+        raise ClientError("CONNECTION_CLOSED", "Connection closed during HELLO")
+    if response.get("ERROR") in REFUSED:
+        raise ClientError(response["ERROR"], response.get("ERROR_MESSAGE", ""))
+    if not response.get("CODE") == "SUCCESS":
+        return protocol.Codec()
+    return protocol.Codec(response["ENCODING"], response["COMPRESSION"])
+
+# Build every request for a connection using codec. Raises ClientError for invalid parameters.
+def _build(requests, codec):
+    built = []
+    for command, params in requests:
+        request = build_request(command, params, raw=is_raw(codec))
+        if not type(request) == dict:
+            raise ClientError(request, f"Invalid parameters for {command}")
+        built.append(request)
+    return built
+
+# Put text back to spaces and messages into tuples, so callers see the same results for every encoding.
+# Binary connections to current servers already carry spaces, but older servers sent binary clients
+# text as stored, with underscores, so text is unescaped whatever the codec.
+def _normalise(command, response):
+    if not response.get("CODE") == "SUCCESS":
+        return response
+    text = lambda t: t.replace('_', ' ')
+    if command == "GET_BOARDS":
+        response["BOARDS"] = [text(b) for b in response["BOARDS"]]
+    elif command == "GET_MESSAGES":
+        response["MESSAGES"] = [(text(m[0]), text(m[1])) for m in response["MESSAGES"]]
+    elif command == "SEARCH":
+        response["RESULTS"] = [tuple(text(t) for t in r) for r in response["RESULTS"]]
+    return response
+
+# Returns the response, raising ClientError if it failed
+def _check(response):
+    if not response["CODE"] == "SUCCESS":
+        error = ClientError(response.get("ERROR", "FAIL"), response.get("ERROR_MESSAGE", ""))
+        error.response = response
+        raise error
+    return response
+
+# Tracks which of a pipeline's requests still need sending across attempts
+class _Attempts:
+    def __init__(self, requests, retries, backoff):
+        self.requests = requests # (command, params) pairs
+        self.responses = [None] * len(requests)
+        self.pending = list(range(len(requests))) # Indexes still needing a response
+        self.retries = retries
+        self.backoff = backoff
+        self.attempt = 0
+
+    # Record the responses to the pending requests, as far as they got. Returns seconds to wait before
+    # retrying, or None if nothing is left to do. Raises ClientError if the remaining requests cannot be retried.
+    def record(self, received, failure=None):
+        still = []
+        wait = 0
+        for i, response in zip(self.pending, received + [None] * (len(self.pending) - len(received))):
+            if response is None:
+                # Only requests that were never sent, or that are safe to repeat, may be retried
+                if failure and not self.requests[i][0] in IDEMPOTENT and failure.code == "SENT":
+                    raise ClientError("CONNECTION_FAILED", f"Connection failed after sending {self.requests[i][0]}. It may or may not have been carried out")
+                still.append(i)
+            elif response.get("ERROR") in REFUSED:
+                still.append(i)
+                self.responses[i] = response
+                wait = max(wait, response.get("RETRY_AFTER", 0))
+            else:
+                self.responses[i] = response
+        self.pending = still
+        if not still:
+            return None
+        if self.attempt >= self.retries:
+            if failure and not any(self.responses[i] for i in still):
+                raise ClientError("CONNECTION_FAILED", str(failure.__cause__ or failure))
+            return None # Out of retries. Refused requests keep their refusal as their response.
+        self.attempt += 1
+        return max(wait, self.backoff * 2 ** (self.attempt - 1))
+
+# Returns the failure code for a connection lost before reading every response. A reused connection the
+# server closed or reset before answering anything was closed for being idle before our requests reached
+# it: STALE, and they are sent again on another connection without using up a retry.
+def _lost(connection, received, error=None):
+    if connection.reused and not received and (error is None or isinstance(error, (ConnectionResetError, BrokenPipeError))):
+        return "STALE"
+    return "SENT"
+
+# One pooled framed connection and the codec it negotiated
+class _Connection:
+    def __init__(self, host, port, timeout, encodings, compression):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.settimeout(timeout) # Applies to every send and receive
+        try:
+            protocol.send_frame(self.sock, _hello(encodings, compression))
+            self.codec = _agreed(protocol.recv_frame(self.sock))
+        except Exception:
+            self.sock.close()
+            raise
+        self.reused = False # Set once back in the pool, where the server may close it for being idle
+        self.idle_since = None
+
+    # Returns True if the connection has been idle at most max_idle seconds and the server has not closed it.
+    # Nothing is sent on an idle connection, so anything to read means the server has closed it.
+    def usable(self, max_idle):
+        if time.monotonic() - self.idle_since > max_idle:
+            return False
+        try:
+            return not select.select([self.sock], [], [], 0)[0]
+        except (OSError, ValueError):
+            return False
+
+    # Send every request at once, then read responses in order. Returns those received before any failure
+    # and the failure. A refusal for being busy is followed by the server closing, so reading stops there.
+    def pipeline(self, requests):
+        received = []
+        try:
+            self.sock.sendall(b''.join(protocol.encode_frame(r, self.codec) for r in _build(requests, self.codec)))
+        except (OSError, protocol.FrameError) as e:
+            error = ClientError("NOT_SENT")
+            error.__cause__ = e
+            return received, error
+        for _ in requests:
+            try:
+                response = protocol.recv_frame(self.sock, self.codec)
+            except (OSError, protocol.FrameError) as e:
+                error = ClientError(_lost(self, received, e))
+                error.__cause__ = e
+                return received, error
+            if response is None:
+                return received, ClientError(_lost(self, received))
+            received.append(response)
+            if response.get("ERROR") == "SERVER_BUSY":
+                return received, ClientError("NOT_SENT")
+        return received, None
+
+    def close(self):
+        self.sock.close()
+
+# Thread safe pool of at most size open connections
+class ConnectionPool:
+    def __init__(self, host, port, size=8, timeout=10.0, encodings=protocol.Codec.ENCODINGS, compression=protocol.Codec.COMPRESSIONS, max_idle=20.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout # Seconds allowed to connect, to wait for a free connection and for each response
+        self.max_idle = max_idle # Seconds an idle connection is kept. Keep below the server's idle timeout
+        self.encodings = encodings # Encodings offered to the server, most preferred first
+        self.compression = compression # Compression offered to the server
+        self.slots = threading.BoundedSemaphore(size) # One per connection, idle or in use
+        self.lock = threading.Lock()
+        self.idle = [] # Connections ready for reuse
+
+    # Returns an idle connection the server has not closed, or a new one if there is room.
+    # Raises ClientError if none is free in time.
+    def acquire(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise ClientError("POOL_TIMEOUT", f"No free connection within {self.timeout} seconds")
+        while True:
+            with self.lock:
+                connection = self.idle.pop() if self.idle else None
+            if connection is None:
+                break
+            if connection.usable(self.max_idle):
+                return connection
+            connection.close()
+        try:
+            return _Connection(self.host, self.port, self.timeout, self.encodings, self.compression)
+        except (OSError, protocol.FrameError, ClientError) as e:
+            self.slots.release()
+            raise ClientError("NO_CONNECTION", str(e))
+
+    # Return a connection to the pool. Connections that failed are closed instead.
+    def release(self, connection, healthy=True):
+        if healthy:
+            connection.reused = True
+            connection.idle_since = time.monotonic()
+            with self.lock:
+                self.idle.append(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    # Close every idle connection
+    def close(self):
+        with self.lock:
+            for connection in self.idle:
+                connection.close()
+            self.idle = []
+
+class BoardClient:
+    def __init__(self, host, port, pool_size=8, timeout=10.0, retries=2, backoff=0.1,
+                 encodings=protocol.Codec.ENCODINGS, compression=protocol.Codec.COMPRESSIONS, max_idle=20.0):
+        self.pool = ConnectionPool(host, port, pool_size, timeout, encodings, compression, max_idle)
+        self.pool_size = pool_size
+        self.retries = retries # Times a failed or refused request is sent again
+        self.backoff = backoff # Seconds before the first retry, doubling each time
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+
+    # Send (command, params) requests pipelined down one connection, retrying as needed.
+    # Returns the response dicts in order. Only connection failures raise.
+    def request_many(self, requests):
+        attempts = _Attempts(requests, self.retries, self.backoff)
+        while True:
+            failure = None
+            try:
+                connection = self.pool.acquire()
+            except ClientError as e:
+                if not e.code == "NO_CONNECTION":
+                    raise
+                received, failure = [], ClientError("NOT_SENT")
+                failure.__cause__ = e
+            else:
+                received, failure = connection.pipeline([requests[i] for i in attempts.pending])
+                self.pool.release(connection, healthy=failure is None)
+                if failure and failure.code == "STALE":
+                    continue
+                received = [_normalise(requests[i][0], r) for i, r in zip(attempts.pending, received)]
+            wait = attempts.record(received, failure)
+            if wait is None:
+                return attempts.responses
+            time.sleep(wait)
+
+    # Send one request. Returns its response dict.
+    def request(self, command, params=[]):
+        return self.request_many([(command, params)])[0]
+
+    def get_boards(self):
+        return _check(self.request("GET_BOARDS"))["BOARDS"]
+
+    # Returns (title, message) tuples, newest first. Paging fields are passed through to the server.
+    def get_messages(self, board, limit=None, before=None, since=None):
+        paging = {"LIMIT": limit, "BEFORE": before, "SINCE": since}
+        return _check(self.request("GET_MESSAGES", [board, paging] if any(v is not None for v in paging.values()) else [board]))["MESSAGES"]
+
+    def post_message(self, board, title, message):
+        _check(self.request("POST_MESSAGE", [board, title, message]))
+
+    # Post many (board, title, message) tuples. Returns the per message results.
+    def post_messages(self, messages):
+        return _check(self.request("POST_MESSAGES", list(messages)))["RESULTS"]
+
+    # Returns (board, title, message) tuples containing every word of query
+    def search(self, query, board=None, limit=None):
+        return _check(self.request("SEARCH", [query, {"BOARD": board, "LIMIT": limit}]))["RESULTS"]
+
+    def get_stats(self):
+        return _check(self.request("GET_STATS"))["STATS"]
+
+    # Fetch GET_MESSAGES for every board at once. The boards are split across up to pool_size connections
+    # that each pipeline their share, so the whole set takes about one round trip.
+    # Returns {board: [(title, message), ...]}. Boards that failed map to their ClientError.
+    def fetch_all_boards(self, boards=None, limit=None):
+        boards = self.get_boards() if boards is None else list(boards)
+        chunks = [boards[i::self.pool_size] for i in range(min(self.pool_size, len(boards)))]
+        params = lambda b: [b, {"LIMIT": limit}] if limit else [b]
+        results = {}
+
+        def fetch(chunk):
+            try:
+                responses = self.request_many([("GET_MESSAGES", params(b)) for b in chunk])
+            except ClientError as e:
+                responses = [e] * len(chunk)
+            for board, response in zip(chunk, responses):
+                try:
+                    results[board] = response if isinstance(response, ClientError) else _check(response)["MESSAGES"]
+                except ClientError as e:
+                    results[board] = e
+
+        threads = [threading.Thread(target=fetch, args=(chunk,)) for chunk in chunks[1:]]
+        for thread in threads:
+            thread.start()
+        if chunks:
+            fetch(chunks[0]) # The calling thread takes a share too
+        for thread in threads:
+            thread.join()
+        return {board: results[board] for board in boards}
+
+# asyncio equivalent of _Connection
+class _AsyncConnection:
+    @classmethod
+    async def open(cls, host, port, timeout, encodings, compression):
+        self = cls()
+        self.timeout = timeout
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        try:
+            self.writer.write(protocol.encode_frame(_hello(encodings, compression)))
+            self.codec = _agreed(await asyncio.wait_for(protocol.read_frame(self.reader), timeout))
+        except BaseException:
+            self.writer.close()
+            raise
+        self.reused = False
+        self.idle_since = None
+        return self
+
+    # Returns True if the connection has been idle at most max_idle seconds and the server has not closed it
+    def usable(self, max_idle):
+        return time.monotonic() - self.idle_since <= max_idle and not (self.reader.at_eof() or self.writer.is_closing())
+
+    async def pipeline(self, requests):
+        received = []
+        try:
+            self.writer.write(b''.join(protocol.encode_frame(r, self.codec) for r in _build(requests, self.codec)))
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+        except (OSError, asyncio.TimeoutError, protocol.FrameError) as e:
+            error = ClientError("NOT_SENT")
+            error.__cause__ = e
+            return received, error
+        for _ in requests:
+            try:
+                response = await asyncio.wait_for(protocol.read_frame(self.reader, codec=self.codec), self.timeout)
+            except (OSError, asyncio.TimeoutError, protocol.FrameError) as e:
+                error = ClientError(_lost(self, received, e))
+                error.__cause__ = e
+                return received, error
+            if response is None:
+                return received, ClientError(_lost(self, received))
+            received.append(response)
+            if response.get("ERROR") == "SERVER_BUSY":
+                return received, ClientError("NOT_SENT")
+        return received, None
+
+    def close(self):
+        self.writer.close()
+
+# asyncio equivalent of ConnectionPool. Must be used from a single event loop.
+class AsyncConnectionPool:
+    def __init__(self, host, port, size=8, timeout=10.0, encodings=protocol.Codec.ENCODINGS, compression=protocol.Codec.COMPRESSIONS, max_idle=20.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.encodings = encodings
+        self.compression = compression
+        self.slots = asyncio.BoundedSemaphore(size)
+        self.idle = []
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise ClientError("POOL_TIMEOUT", f"No free connection within {self.timeout} seconds")
+        while self.idle:
+            connection = self.idle.pop()
+            if connection.usable(self.max_idle):
+                return connection
+            connection.close()
+        try:
+            return await _AsyncConnection.open(self.host, self.port, self.timeout, self.encodings, self.compression)
+        except (OSError, asyncio.TimeoutError, protocol.FrameError, ClientError) as e:
+            self.slots.release()
+            raise ClientError("NO_CONNECTION", str(e))
+
+    def release(self, connection, healthy=True):
+        if healthy:
+            connection.reused = True
+            connection.idle_since = time.monotonic()
+            self.idle.append(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle = []
+
+# asyncio equivalent of BoardClient. Every method is a coroutine.
+class AsyncBoardClient(BoardClient):
+    def __init__(self, host, port, pool_size=8, timeout=10.0, retries=2, backoff=0.1,
+                 encodings=protocol.Codec.ENCODINGS, compression=protocol.Codec.COMPRESSIONS, max_idle=20.0):
+        self.pool = AsyncConnectionPool(host, port, pool_size, timeout, encodings, compression, max_idle)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def request_many(self, requests):
+        attempts = _Attempts(requests, self.retries, self.backoff)
+        while True:
+            failure = None
+            try:
+                connection = await self.pool.acquire()
+            except ClientError as e:
+                if not e.code == "NO_CONNECTION":
+                    raise
+                received, failure = [], ClientError("NOT_SENT")
+                failure.__cause__ = e
+            else:
+                received, failure = await connection.pipeline([requests[i] for i in attempts.pending])
+                self.pool.release(connection, healthy=failure is None)
+                if failure and failure.code == "STALE":
+                    continue
+                received = [_normalise(requests[i][0], r) for i, r in zip(attempts.pending, received)]
+            wait = attempts.record(received, failure)
+            if wait is None:
+                return attempts.responses
+            await asyncio.sleep(wait)
+
+    async def request(self, command, params=[]):
+        return (await self.request_many([(command, params)]))[0]
+
+    async def get_boards(self):
+        return _check(await self.request("GET_BOARDS"))["BOARDS"]
+
+    async def get_messages(self, board, limit=None, before=None, since=None):
+        paging = {"LIMIT": limit, "BEFORE": before, "SINCE": since}
+        return _check(await self.request("GET_MESSAGES", [board, paging] if any(v is not None for v in paging.values()) else [board]))["MESSAGES"]
+
+    async def post_message(self, board, title, message):
+        _check(await self.request("POST_MESSAGE", [board, title, message]))
+
+    async def post_messages(self, messages):
+        return _check(await self.request("POST_MESSAGES", list(messages)))["RESULTS"]
+
+    async def search(self, query, board=None, limit=None):
+        return _check(await self.request("SEARCH", [query, {"BOARD": board, "LIMIT": limit}]))["RESULTS"]
+
+    async def get_stats(self):
+        return _check(await self.request("GET_STATS"))["STATS"]
+
+    # Fetch GET_MESSAGES for every board at once, split across up to pool_size pipelined connections
+    async def fetch_all_boards(self, boards=None, limit=None):
+        boards = await self.get_boards() if boards is None else list(boards)
+        chunks = [boards[i::self.pool_size] for i in range(min(self.pool_size, len(boards)))]
+        params = lambda b: [b, {"LIMIT": limit}] if limit else [b]
+        results = {}
+
+        async def fetch(chunk):
+            try:
+                responses = await self.request_many([("GET_MESSAGES", params(b)) for b in chunk])
+            except ClientError as e:
+                responses = [e] * len(chunk)
+            for board, response in zip(chunk, responses):
+                try:
+                    results[board] = response if isinstance(response, ClientError) else _check(response)["MESSAGES"]
+                except ClientError as e:
+                    results[board] = e
+
+        await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+        return {board: results[board] for board in boards}
+
 # Main function to display menu, handle inputs and pass responses and requests to other functions
 def display_menu(server_ip, server_port):
     if server_port < 1 or server_port > 65535:
@@ -113,33 +777,36 @@ def display_menu(server_ip, server_port):
         print("Terminating..")
         exit()
 
-    # Attempt to connect to server
+    # Attempt to connect to server. This connection is kept open and reused for every request.
     client_socket = connect(server_ip, server_port)
     if not client_socket:
         print("Terminating..")
         exit()
 
-    # Get the list of boards as the first request
-    response = send_request("GET_BOARDS", client_socket)
+    # Agree on the encoding, then get the list of boards as the first request
+    codec = negotiate(client_socket)
+    response = send_request("GET_BOARDS", client_socket, codec=codec) if isinstance(codec, protocol.Codec) else codec
     if not type(response) == dict:
         if client_socket:
             client_socket.close()
         print("Terminating..")
         exit() # Failed at first request. Terminating as we cannot continue.
 
-    boards_dict = handle_response("GET_BOARDS", response)
+    boards_dict = handle_response("GET_BOARDS", response, is_raw(codec))
 
     if not type(boards_dict) == dict:
+        client_socket.close()
         print("Terminating..")
         exit()
 
-    client_socket.close()
-
     # Enter menu loop
     while True:
         # Display menu options and get input
         print("\nX - Where X is a number in the list to view this board")
         print("POST - Post a message to a board.")
+        print("WATCH - Show new messages on a board as they are posted.")
+        print("SEARCH - Find messages containing some words.")
+        print("CREATE - Create a new board (admin).")
         print("QUIT - Close the program")
         user_input = input("> ")
         
@@ -165,30 +832,71 @@ def display_menu(server_ip, server_port):
 
             post_params.append(user_input)
 
-            client_socket = connect(server_ip, server_port) # Attempt to connect to server
-            if not client_socket:
+            # Pass to sender function, reconnecting if the server closed our idle connection
+            response, client_socket, codec = persistent_request("POST_MESSAGE", client_socket, server_ip, server_port, post_params, codec)
+            if not type(response) == dict:
                 continue
 
-            response = send_request("POST_MESSAGE", client_socket, post_params) # Pass to sender function
+            handle_response("POST_MESSAGE", response, is_raw(codec)) # Pass response to handler function
+
+        elif user_input == "CREATE": # Create a board, then fetch the board list again so it can be used
+            print("Enter new board name:")
+            board_name = input("> ")
+            print("Enter admin token (leave empty if none):")
+            token = input("> ")
+
+            response, client_socket, codec = persistent_request("CREATE_BOARD", client_socket, server_ip, server_port, [board_name, token], codec)
             if not type(response) == dict:
-                client_socket.close()
+                continue
+            handle_response("CREATE_BOARD", response, is_raw(codec))
+            if not response["CODE"] == "SUCCESS":
                 continue
 
-            handle_response("POST_MESSAGE", response) # Pass response to handler function
-            client_socket.close() # Close the socket
+            response, client_socket, codec = persistent_request("GET_BOARDS", client_socket, server_ip, server_port, [], codec)
+            if type(response) == dict:
+                boards_dict = handle_response("GET_BOARDS", response, is_raw(codec)) or boards_dict
 
-        elif user_input in boards_dict: # Get a Message from a board
-            client_socket = connect(server_ip, server_port) # Attempt to connect to server
-            if not socket:
+        elif user_input == "SEARCH": # Search every board for messages containing all the given words
+            print("Enter words to search for:")
+            user_input = input("> ")
+
+            response, client_socket, codec = persistent_request("SEARCH", client_socket, server_ip, server_port, [user_input], codec)
+            if not type(response) == dict:
                 continue
 
-            response = send_request("GET_MESSAGES", client_socket, [boards_dict[user_input]]) # Pass to sender function
+            handle_response("SEARCH", response, is_raw(codec)) # Pass response to handler function
+
+        elif user_input == "WATCH": # Stream new posts to a board until interrupted, on a connection of its own
+            print("Enter board number:")
+            user_input = input("> ")
+            if not user_input in boards_dict:
+                print("ERROR:\tBoard does not exist.")
+                continue
+
+            watch_socket = connect(server_ip, server_port)
+            if not watch_socket:
+                continue
+            watch_codec = negotiate(watch_socket)
+            if not isinstance(watch_codec, protocol.Codec):
+                watch_socket.close()
+                continue
+            print("Watching for new messages. Press Ctrl+C to stop.")
+            try:
+                for post in subscribe(watch_socket, [boards_dict[user_input]], watch_codec):
+                    if not type(post) == tuple:
+                        break
+                    handle_response("GET_MESSAGES", {"CODE": "SUCCESS", "MESSAGES": [post[1:]]}, is_raw(watch_codec))
+            except KeyboardInterrupt:
+                print()
+            watch_socket.close()
+
+        elif user_input in boards_dict: # Get a Message from a board
+            # Pass to sender function, reconnecting if the server closed our idle connection
+            response, client_socket, codec = persistent_request("GET_MESSAGES", client_socket, server_ip, server_port, [boards_dict[user_input]], codec)
             if not type(response) == dict:
-                client_socket.close()
                 continue
 
-            handle_response("GET_MESSAGES", response) # Pass response to handler function
-            client_socket.close() # Close the socket
+            handle_response("GET_MESSAGES", response, is_raw(codec)) # Pass response to handler function
         elif user_input.isdigit(): # If it is a digit, but not a digit in the board menu, reject.
             print("ERROR:\tBoard specified does not exist.")
             continue
@@ -0,0 +1,270 @@
+import struct # For packing frame headers
+import json # For encoding messages
+import zlib # For compressing large frames
+
+try:
+    import msgpack # Faster binary encoding when installed. The fallback below speaks the same format.
+except ImportError:
+    msgpack = None
+
+# Framed protocol: every message is a 4 byte big-endian header followed by a payload.
+# Legacy (unframed) requests are a bare JSON object so always start with '{'. Frames are limited
+# to 16MiB so the first byte of a frame header is always zero, which is how the server tells them apart.
+# The low 24 bits of the header hold the payload length and the top bit is set when the payload is
+# zlib compressed. Only connections that negotiated compression with HELLO ever set it.
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = (1 << 24) - 1
+COMPRESSED = 0x80000000
+COMPRESS_THRESHOLD = 1024 # Payloads smaller than this are not worth compressing
+
+class FrameError(Exception):
+    pass
+
+# Binary encoding. A subset of MessagePack: encoding only ever produces fixint, int64, float64, str,
+# bin, array and map, and decoding accepts everything MessagePack produces for those types.
+def _pack(obj, out):
+    if obj is None:
+        out.append(b'\xc0')
+    elif obj is True:
+        out.append(b'\xc3')
+    elif obj is False:
+        out.append(b'\xc2')
+    elif isinstance(obj, int):
+        if 0 <= obj < 128:
+            out.append(bytes((obj,)))
+        elif obj >= 1 << 63:
+            out.append(b'\xcf' + struct.pack('>Q', obj))
+        else:
+            out.append(b'\xd3' + struct.pack('>q', obj))
+    elif isinstance(obj, float):
+        out.append(b'\xcb' + struct.pack('>d', obj))
+    elif isinstance(obj, str):
+        data = obj.encode()
+        if len(data) < 32:
+            out.append(bytes((0xa0 | len(data),)))
+        else:
+            out.append(b'\xdb' + struct.pack('>I', len(data)))
+        out.append(data)
+    elif isinstance(obj, (bytes, bytearray)):
+        out.append(b'\xc6' + struct.pack('>I', len(obj)))
+        out.append(bytes(obj))
+    elif isinstance(obj, (list, tuple)):
+        if len(obj) < 16:
+            out.append(bytes((0x90 | len(obj),)))
+        else:
+            out.append(b'\xdd' + struct.pack('>I', len(obj)))
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        if len(obj) < 16:
+            out.append(bytes((0x80 | len(obj),)))
+        else:
+            out.append(b'\xdf' + struct.pack('>I', len(obj)))
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f"Cannot encode {type(obj).__name__}")
+
+# Fixed size types: tag -> (struct format, size)
+_FIXED = {0xca: ('>f', 4), 0xcb: ('>d', 8), 0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+          0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8)}
+# Variable length types: tag -> (kind, struct format of the length, its size)
+_SIZED = {0xc4: ('bin', '>B', 1), 0xc5: ('bin', '>H', 2), 0xc6: ('bin', '>I', 4),
+          0xd9: ('str', '>B', 1), 0xda: ('str', '>H', 2), 0xdb: ('str', '>I', 4),
+          0xdc: ('array', '>H', 2), 0xdd: ('array', '>I', 4), 0xde: ('map', '>H', 2), 0xdf: ('map', '>I', 4)}
+
+# Decode the object starting at data[i]. Returns the object and the index just past it.
+# Strings, arrays and maps are checked first as they make up almost every response.
+def _unpack(data, i):
+    tag = data[i]
+    i += 1
+    if 0xa0 <= tag <= 0xbf or tag in (0xd9, 0xda, 0xdb):
+        if tag <= 0xbf:
+            n = tag & 0x1f
+        else:
+            _, fmt, size = _SIZED[tag]
+            n = struct.unpack_from(fmt, data, i)[0]
+            i += size
+        end = i + n
+        if end > len(data):
+            raise ValueError("Truncated string")
+        return data[i:end].decode(), end
+    if 0x80 <= tag <= 0x9f or tag in (0xdc, 0xdd, 0xde, 0xdf):
+        if tag <= 0x9f:
+            kind, n = ('map' if tag <= 0x8f else 'array'), tag & 0x0f
+        else:
+            kind, fmt, size = _SIZED[tag]
+            n = struct.unpack_from(fmt, data, i)[0]
+            i += size
+        if kind == 'array':
+            items = []
+            for _ in range(n):
+                item, i = _unpack(data, i)
+                items.append(item)
+            return items, i
+        result = {}
+        for _ in range(n):
+            key, i = _unpack(data, i)
+            result[key], i = _unpack(data, i)
+        return result, i
+    if tag < 0x80:
+        return tag, i
+    if tag >= 0xe0:
+        return tag - 0x100, i
+    if tag == 0xc0:
+        return None, i
+    if tag == 0xc2:
+        return False, i
+    if tag == 0xc3:
+        return True, i
+    if tag in _FIXED:
+        fmt, size = _FIXED[tag]
+        return struct.unpack_from(fmt, data, i)[0], i + size
+    if tag in (0xc4, 0xc5, 0xc6):
+        _, fmt, size = _SIZED[tag]
+        n = struct.unpack_from(fmt, data, i)[0]
+        i += size
+        if i + n > len(data):
+            raise ValueError("Truncated bytes")
+        return data[i:i + n], i + n
+    raise ValueError(f"Unsupported type 0x{tag:02x}")
+
+# Encode an object with the binary encoding
+def pack(obj):
+    if msgpack:
+        return msgpack.packb(obj, use_bin_type=True)
+    out = []
+    _pack(obj, out)
+    return b''.join(out)
+
+# Decode an object encoded with the binary encoding
+def unpack(data):
+    if msgpack:
+        return msgpack.unpackb(data, raw=False)
+    obj, i = _unpack(bytes(data), 0)
+    if not i == len(data):
+        raise ValueError("Trailing bytes after object")
+    return obj
+
+# How frames on one connection are encoded. Every connection starts as JSON without compression and
+# may switch once, straight after a successful HELLO exchange.
+class Codec:
+    ENCODINGS = ("binary", "json") # Supported encodings, most preferred first
+    COMPRESSIONS = ("zlib",) # Supported compression
+
+    def __init__(self, encoding="json", compression=None):
+        self.encoding = encoding
+        self.compression = compression
+
+    # Encode an object as a payload
+    def dumps(self, obj):
+        if self.encoding == "binary":
+            return pack(obj)
+        return json.dumps(obj).encode()
+
+    # Decode a payload into an object
+    def loads(self, payload):
+        try:
+            if self.encoding == "binary":
+                return unpack(payload)
+            return json.loads(payload.decode())
+        except Exception as e:
+            raise FrameError(f"Invalid frame payload: {e}")
+
+    # Encode an object as a complete frame. Bytes are taken to be an already encoded payload.
+    def frame(self, obj):
+        payload = obj if isinstance(obj, bytes) else self.dumps(obj)
+        flags = 0
+        if self.compression == "zlib" and len(payload) >= COMPRESS_THRESHOLD:
+            payload = zlib.compress(payload, 1) # Fastest level, most of the win for text
+            flags = COMPRESSED
+        if len(payload) > MAX_FRAME_SIZE:
+            raise FrameError(f"Frame of {len(payload)} bytes exceeds maximum of {MAX_FRAME_SIZE}")
+        return HEADER.pack(flags | len(payload)) + payload
+
+    # Decode a received payload, given the flags from its header
+    def unframe(self, flags, payload):
+        if flags & COMPRESSED:
+            if not self.compression:
+                raise FrameError("Compressed frame on a connection without compression")
+            decompressor = zlib.decompressobj()
+            try:
+                payload = decompressor.decompress(payload, MAX_FRAME_SIZE)
+            except zlib.error as e:
+                raise FrameError(f"Invalid compressed frame: {e}")
+            if decompressor.unconsumed_tail:
+                raise FrameError(f"Decompressed frame exceeds maximum of {MAX_FRAME_SIZE}")
+        return self.loads(payload)
+
+JSON = Codec() # Codec of every connection that has not negotiated anything else
+
+# Pick the encoding and compression to use from those a client offered in HELLO.
+# Returns None for anything we share no option for.
+def choose(offered, supported):
+    for option in supported:
+        if option in offered:
+            return option
+    return None
+
+# Returns True if the first byte received on a connection starts a frame rather than a legacy request
+def is_framed(first_byte):
+    return first_byte[:1] == b'\x00'
+
+# Encode an object as a complete frame
+def encode_frame(obj, codec=None):
+    return (codec or JSON).frame(obj)
+
+# Decode a frame payload into an object
+def decode_payload(payload, flags=0, codec=None):
+    return (codec or JSON).unframe(flags, payload)
+
+# Read the payload length and flags from a frame header
+def payload_length(header):
+    word = HEADER.unpack(header)[0]
+    return word & MAX_FRAME_SIZE, word & ~MAX_FRAME_SIZE
+
+# Receive exactly n bytes from a blocking socket. Returns None if the peer closed before sending anything.
+def recv_exact(sock, n):
+    chunks = []
+    remaining = n
+    while remaining:
+        chunk = sock.recv(min(remaining, 65536))
+        if not chunk:
+            if remaining == n:
+                return None
+            raise FrameError("Connection closed mid-frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+# Send an object as a frame on a blocking socket
+def send_frame(sock, obj, codec=None):
+    sock.sendall(encode_frame(obj, codec))
+
+# Receive one frame from a blocking socket. Returns None when the peer has closed the connection.
+def recv_frame(sock, codec=None):
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    length, flags = payload_length(header)
+    payload = recv_exact(sock, length) if length else b''
+    if payload is None:
+        raise FrameError("Connection closed mid-frame")
+    return decode_payload(payload, flags, codec)
+
+# Receive one frame from an asyncio StreamReader. prefix holds any header bytes already read.
+# Returns None when the peer has closed the connection.
+async def read_frame(reader, prefix=b'', codec=None):
+    try:
+        header = prefix + await reader.readexactly(HEADER.size - len(prefix))
+    except EOFError as e: # IncompleteReadError is a subclass of EOFError
+        if not prefix and not e.partial:
+            return None
+        raise FrameError("Connection closed mid-frame")
+    length, flags = payload_length(header)
+    try:
+        payload = await reader.readexactly(length) if length else b''
+    except EOFError:
+        raise FrameError("Connection closed mid-frame")
+    return decode_payload(payload, flags, codec)
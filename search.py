@@ -0,0 +1,108 @@
+import re # For splitting text into tokens
+import sys # For the largest page size
+import bisect # For intersecting sorted postings
+import heapq # For merging matches from every board by post time
+import threading # For guarding the index against concurrent posts
+from array import array # Compact postings lists
+
+# In-memory inverted index over message titles and bodies. Every message gets a small id within its
+# board, in the order it was added, and each (board, token) maps to the sorted ids of the messages
+# containing it. A query is the AND of its tokens, answered newest first by walking the shortest
+# postings list from the end and probing the others with binary search. Each message's post time is
+# kept too, so matches from several boards are merged newest first rather than board by board.
+
+# Tokens are runs of letters and digits. Underscores split tokens too, as JSON clients send spaces as underscores.
+TOKEN = re.compile(r"[^\W_]+")
+
+# Returns the distinct lowercase tokens in some text
+def tokenize(text):
+    return set(TOKEN.findall(text.lower()))
+
+class SearchIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refs = {} # Board title -> list of refs, indexed by message id
+        self.ids = {} # Board title -> {ref: message id}, so a message is never indexed twice
+        self.postings = {} # (Board title, token) -> array of message ids, ascending
+        self.times = {} # Board title -> array of post times, indexed by message id
+
+    # Index every message already in storage, oldest first. Indexes board_titles, or every board if None.
+    def build(self, storage, read, board_titles=None):
+        for board_title in storage.board_titles() if board_titles is None else board_titles:
+            _, refs = storage.latest(board_title, sys.maxsize) # Every message, newest first
+            for ref in reversed(refs):
+                try:
+                    message_title, message = read(board_title, ref)
+                    posted = storage.post_time(board_title, ref)
+                except Exception as e:
+                    print(f"ERROR:\tFailed to index message {ref} from {board_title}")
+                    print(e)
+                    continue
+                self.add(board_title, ref, message_title, message, posted)
+
+    # Index one message, posted at seconds since the epoch
+    def add(self, board_title, ref, message_title, message, posted):
+        tokens = tokenize(message_title) | tokenize(message)
+        with self.lock:
+            ids = self.ids.setdefault(board_title, {})
+            if ref in ids:
+                return
+            refs = self.refs.setdefault(board_title, [])
+            message_id = len(refs)
+            refs.append(ref)
+            ids[ref] = message_id
+            self.times.setdefault(board_title, array('d')).append(posted)
+            for token in tokens:
+                postings = self.postings.get((board_title, token))
+                if postings is None:
+                    postings = self.postings[(board_title, token)] = array('I')
+                postings.append(message_id) # Ids only grow so postings stay sorted
+
+    # Forget everything indexed for a board
+    def remove_board(self, board_title):
+        with self.lock:
+            self.refs.pop(board_title, None)
+            self.ids.pop(board_title, None)
+            self.times.pop(board_title, None)
+            self.postings = {key: postings for key, postings in self.postings.items() if not key[0] == board_title}
+
+    # Returns up to limit (board title, ref) pairs of messages containing every token in query,
+    # newest first across every board searched. Searches board_titles, or every indexed board if None.
+    def search(self, query, board_titles=None, limit=20):
+        tokens = tokenize(query)
+        results = []
+        if not tokens:
+            return results
+        with self.lock:
+            boards = [self._matches(board_title, tokens) for board_title in (self.refs if board_titles is None else board_titles)]
+            for _, board_title, ref in heapq.merge(*boards, key=lambda match: -match[0]):
+                results.append((board_title, ref))
+                if len(results) >= limit:
+                    break
+        return results
+
+    # Yields (post time, board title, ref) for the messages in a board containing every token, newest
+    # first. Lazy, so a search stops reading postings once it has enough. Caller holds self.lock.
+    def _matches(self, board_title, tokens):
+        lists = []
+        for token in tokens:
+            postings = self.postings.get((board_title, token))
+            if not postings:
+                return
+            lists.append(postings)
+        lists.sort(key=len)
+        refs = self.refs[board_title]
+        times = self.times[board_title]
+        for message_id in reversed(lists[0]):
+            if all(self._contains(postings, message_id) for postings in lists[1:]):
+                yield times[message_id], board_title, refs[message_id]
+
+    # Returns True if the sorted postings hold message_id
+    def _contains(self, postings, message_id):
+        i = bisect.bisect_left(postings, message_id)
+        return i < len(postings) and postings[i] == message_id
+
+    # Returns a dict of counters describing the index
+    def stats(self):
+        with self.lock:
+            return {"BOARDS": len(self.refs), "MESSAGES": sum(len(refs) for refs in self.refs.values()), "TERMS": len(self.postings)}
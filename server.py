@@ -5,51 +5,689 @@ import time # For getting time for filename generation
 import json # For encoding messages
 import threading # For handling threading (when multiple clients want to connect)
 import _thread
+import argparse # For parsing command line options
+import asyncio # For the asyncio based server engine
+import bisect # For finding latency histogram buckets
+import queue # For handing log lines to the writer thread
+import collections # For queueing connections waiting for a handler
+import atexit # For flushing the log on exit
+import signal # For shutting down cleanly on SIGTERM
+import multiprocessing # For pre-forking worker processes
+import http.server # For the plaintext metrics side port
+import re # For validating new board names
+import math # For rejecting SINCE times that are not finite
+from collections import OrderedDict # For the LRU cache
+import protocol # Length-prefixed framing shared with the client
+from storage import FileStorage, SegmentStorage # Board storage backends
+from search import SearchIndex # Inverted index behind SEARCH
+from watch import BoardWatcher # Picks up boards added or removed on disk
+
+try:
+    import resource # For raising the open file limit (Unix only)
+except ImportError:
+    resource = None
 
 class Logger:
-    def __init__(self, log_file):
+    # buffered moves writing onto a background thread which appends queued lines in batches of up to
+    # batch_size, at least every flush_interval seconds. If max_bytes is set the log is rotated to
+    # log_file.1 .. log_file.{backup_count} once it grows past that size.
+    # When several worker processes share a log only one should rotate it. The others have rotate unset
+    # and just follow: they reopen the log once it has been moved away from under them.
+    def __init__(self, log_file, buffered=False, batch_size=256, flush_interval=1.0, max_bytes=0, backup_count=5, rotate=True):
         self.log_file = log_file # Set log file path
+        self.batch_size = batch_size # Most lines written by one batch
+        self.flush_interval = flush_interval # Longest a line waits in the queue
+        self.max_bytes = max_bytes # Rotate once the log reaches this size, 0 to never rotate
+        self.backup_count = backup_count # Number of rotated logs to keep
+        self.rotate = rotate # Rotate the log ourselves, rather than leaving it to another process
+        self.lock = threading.Lock() # Stops lines from different handler threads interleaving
+        self.queue_lock = threading.Lock() # Keeps lines from being queued behind close's sentinel
+        self.queue = None
+        self.closed = False
+
+        if buffered:
+            self.queue = queue.Queue()
+            self.writer = threading.Thread(target=self._write_batches, name="LoggerWriter", daemon=True)
+            self.writer.start()
+            atexit.register(self.close) # Make sure queued lines reach the disk on shutdown
 
     def write(self, command, success, address, port):
+        # Write a log entry using this lovely line of code
+        line = f"{address}:{port}\t{time.strftime('%d/%m/%Y %H:%M:%S')}\t{command}\t{'OK' if success else 'Error'}\n"
+        if self.queue:
+            with self.queue_lock:
+                if not self.closed:
+                    self.queue.put(line) # The writer thread takes it from here
+                    return
+            # Closed already, so write the line directly rather than lose it
+
+        with self.lock:
+            try:
+                f = open(self.log_file, mode='a') # Append if it already exists
+                f.write(line)
+                size = f.tell()
+                f.close() # Close the file so we can view the update to the log immediately
+                if self.max_bytes and self.rotate and size >= self.max_bytes:
+                    self._rotate()
+            except Exception as e:
+                print("ERROR:\tFailed to write to logger.")
+                print(e)
+
+    # Background thread. Collects queued lines into batches and appends each batch with a single write.
+    def _write_batches(self):
+        f = None
+        running = True
+        while running:
+            line = self.queue.get()
+            if line is None: # Sentinel from close
+                break
+            lines = [line]
+            deadline = time.monotonic() + self.flush_interval
+            # Keep collecting until the batch is full or the oldest line has waited long enough
+            while len(lines) < self.batch_size:
+                try:
+                    line = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if line is None:
+                    running = False
+                    break
+                lines.append(line)
+
+            with self.lock:
+                try:
+                    if f is None:
+                        f = open(self.log_file, mode='a')
+                    f.write(''.join(lines))
+                    f.flush() # Make the batch visible to anyone reading the log
+                    if self.max_bytes and self.rotate and f.tell() >= self.max_bytes:
+                        f.close()
+                        f = None
+                        self._rotate()
+                    elif self.max_bytes and not self._is_current(f):
+                        f.close() # Another process rotated the log, so reopen it for the next batch
+                        f = None
+                except Exception as e:
+                    print("ERROR:\tFailed to write to logger.")
+                    print(e)
+                    if f:
+                        f.close()
+                    f = None
+
+        if f:
+            f.close()
+
+    # Returns True if the open file f is still the one at log_file
+    def _is_current(self, f):
+        try:
+            return os.stat(self.log_file).st_ino == os.fstat(f.fileno()).st_ino
+        except OSError:
+            return False
+
+    # Shift log_file.N to log_file.N+1, dropping the oldest, then move the current log to log_file.1
+    def _rotate(self):
         try:
-            f = open(self.log_file, mode='a') # Append if it already exists
-            # Write a log entry using this lovely line of code
-            f.write(f"{address}:{port}\t{time.strftime('%d/%m/%Y %H:%M:%S')}\t{command}\t{'OK' if success else 'Error'}\n")
-            f.close() # Close the file so we can view the update to the log immediately
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.log_file}.{i}"):
+                    os.replace(f"{self.log_file}.{i}", f"{self.log_file}.{i + 1}")
+            if self.backup_count > 0:
+                os.replace(self.log_file, f"{self.log_file}.1")
+            else:
+                os.remove(self.log_file)
         except Exception as e:
-            print("ERROR:\tFailed to write to logger.")
+            print("ERROR:\tFailed to rotate log.")
             print(e)
 
+    # Flush anything still queued and stop the writer thread. Safe to call more than once.
+    def close(self):
+        with self.queue_lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.queue:
+                self.queue.put(None)
+        if self.queue:
+            self.writer.join()
+
+# Least recently used cache bounded by the total size in bytes of the values it holds.
+# A max_bytes of 0 disables the cache.
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes # Total size allowed before evicting
+        self.size = 0 # Current total size of cached values
+        self.entries = OrderedDict() # Key -> (value, size), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Returns the cached value for key, or None on a miss
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key) # Now the most recently used
+            self.hits += 1
+            return entry[0]
+
+    # Returns the cached value for key, or None, without counting a hit or miss or marking it used.
+    # For checking ahead whether a later get would hit.
+    def peek(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return None if entry is None else entry[0]
+
+    # Cache value under key, evicting least recently used entries until it fits
+    def put(self, key, value, size=None):
+        size = len(value) if size is None else size
+        if size > self.max_bytes: # Would never fit (also covers a disabled cache)
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.size -= old[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    # Remove key from the cache if present
+    def invalidate(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.size -= old[1]
+
+    # Returns a dict of counters describing the cache
+    def stats(self):
+        with self.lock:
+            return {"HITS": self.hits, "MISSES": self.misses, "EVICTIONS": self.evictions,
+                    "ENTRIES": len(self.entries), "BYTES": self.size, "MAX_BYTES": self.max_bytes}
+
+# Token bucket rate limits per client IP, over all its requests and per command. Each bucket holds up
+# to burst tokens, refills at rate tokens a second and every request takes one. A request finding its
+# bucket empty is refused. Buckets left alone long enough to refill are forgotten so memory stays bounded.
+class RateLimiter:
+    MAX_BUCKETS = 100000 # Buckets held before idle ones are swept
+
+    def __init__(self, limit=None, command_limits={}):
+        self.limit = limit # (rate, burst) applied to all of an IP's requests, or None
+        self.command_limits = dict(command_limits) # Command -> (rate, burst) applied per IP
+        self.lock = threading.Lock()
+        self.buckets = {} # (IP, command or None) -> [tokens, last refill time]
+        self.refused = 0
+
+    # Parse "RATE[:BURST]". The burst defaults to one second's worth of requests.
+    @staticmethod
+    def parse(text):
+        rate, _, burst = text.partition(':')
+        rate = float(rate)
+        burst = float(burst) if burst else max(1.0, rate)
+        if rate <= 0 or burst < 1:
+            raise argparse.ArgumentTypeError(f"Invalid rate limit '{text}'. Expected RATE[:BURST] with RATE > 0 and BURST >= 1")
+        return rate, burst
+
+    # Parse "COMMAND=RATE[:BURST]"
+    @staticmethod
+    def parse_command(text):
+        command, _, limit = text.partition('=')
+        if not command or not limit:
+            raise argparse.ArgumentTypeError(f"Invalid command rate limit '{text}'. Expected COMMAND=RATE[:BURST]")
+        return command.upper(), RateLimiter.parse(limit)
+
+    # Returns bucket key, topped up for the time since it was last used. Caller holds self.lock.
+    def _refill(self, key, rate, burst, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    # Returns 0 if ip may make a request with command now, else roughly how many seconds until it may
+    def check(self, ip, command):
+        command_limit = self.command_limits.get(command)
+        if not self.limit and not command_limit:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            if len(self.buckets) >= self.MAX_BUCKETS:
+                self._sweep(now)
+            # Check every bucket before taking from any, so a refused request uses up none of the allowances
+            buckets = [(self._refill(key, limit[0], limit[1], now), limit[0])
+                       for key, limit in (((ip, command), command_limit), ((ip, None), self.limit)) if limit]
+            wait = max((1 - bucket[0]) / rate for bucket, rate in buckets)
+            if wait > 0:
+                self.refused += 1
+                return wait
+            for bucket, _ in buckets:
+                bucket[0] -= 1
+        return 0
+
+    # Forget buckets that have had time to refill completely. Caller holds self.lock.
+    def _sweep(self, now):
+        for key, (tokens, last) in list(self.buckets.items()):
+            rate, burst = (self.command_limits.get(key[1]) if key[1] else self.limit) or (1, 0)
+            if tokens + (now - last) * rate >= burst:
+                del self.buckets[key]
+
+    def stats(self):
+        with self.lock:
+            return {"BUCKETS": len(self.buckets), "REFUSED": self.refused}
+
+# Request counters, result codes, connection counts and latency histograms for every command.
+# Shared by all handler threads, so every update takes the lock.
+class Metrics:
+    # Upper bounds in seconds of the latency histogram buckets
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.codes = {} # Command -> {result code -> count}
+        self.histograms = {} # Command -> bucket counts
+        self.latency_sums = {} # Command -> total seconds spent
+        self.in_flight = 0 # Connections currently open
+        self.connections = 0 # Connections accepted since starting
+        self.connection_codes = {} # Result code of connections that ended in an error -> count
+        self.refused = 0 # Connections turned away because the server was busy
+
+    # Record one processed request
+    def record(self, command, code, seconds):
+        bucket = bisect.bisect_left(self.BUCKETS, seconds)
+        with self.lock:
+            codes = self.codes.setdefault(command, {})
+            codes[code] = codes.get(code, 0) + 1
+            histogram = self.histograms.setdefault(command, [0] * len(self.BUCKETS))
+            histogram[bucket] += 1
+            self.latency_sums[command] = self.latency_sums.get(command, 0.0) + seconds
+
+    def connection_opened(self):
+        with self.lock:
+            self.in_flight += 1
+            self.connections += 1
+
+    # Record a connection turned away without being handled
+    def connection_refused(self):
+        with self.lock:
+            self.connections += 1
+            self.refused += 1
+
+    # Record the end of a connection and the code its handler returned
+    def connection_closed(self, code):
+        with self.lock:
+            self.in_flight -= 1
+            if not code == "SUCCESS":
+                self.connection_codes[code] = self.connection_codes.get(code, 0) + 1
+
+    # Estimate the p-th percentile (0-100) in seconds from a histogram, as the upper bound of its bucket
+    def _percentile(self, histogram, p):
+        target = sum(histogram) * p / 100
+        seen = 0
+        for bound, count in zip(self.BUCKETS, histogram):
+            seen += count
+            if count and seen >= target:
+                return bound
+        return None
+
+    # Returns a JSON friendly dict of everything recorded so far
+    def snapshot(self):
+        with self.lock:
+            commands = {}
+            for command, codes in self.codes.items():
+                histogram = self.histograms[command]
+                count = sum(histogram)
+                latency = {"MEAN": self.latency_sums[command] / count * 1000}
+                for p in (50, 95, 99):
+                    bound = self._percentile(histogram, p)
+                    latency[f"P{p}"] = bound * 1000 if bound and bound < float('inf') else None
+                latency["BUCKETS"] = {str(bound * 1000): n for bound, n in zip(self.BUCKETS, histogram)}
+                commands[command] = {"COUNT": count, "CODES": dict(codes), "LATENCY_MS": latency}
+            return {
+                "PID": os.getpid(),
+                "UPTIME_S": time.time() - self.started,
+                "CONNECTIONS": {"IN_FLIGHT": self.in_flight, "TOTAL": self.connections, "REFUSED": self.refused, "ERRORS": dict(self.connection_codes)},
+                "COMMANDS": commands,
+            }
+
+    # Returns everything recorded so far as plaintext, one "name{labels} value" line per metric
+    def render_text(self, extra={}):
+        lines = []
+        with self.lock:
+            lines.append(f"board_uptime_seconds {time.time() - self.started:.3f}")
+            lines.append(f"board_connections_in_flight {self.in_flight}")
+            lines.append(f"board_connections_total {self.connections}")
+            lines.append(f"board_connections_refused_total {self.refused}")
+            for code, n in self.connection_codes.items():
+                lines.append(f'board_connection_errors_total{{code="{code}"}} {n}')
+            for command, codes in self.codes.items():
+                for code, n in codes.items():
+                    lines.append(f'board_requests_total{{command="{command}",code="{code}"}} {n}')
+                cumulative = 0
+                for bound, n in zip(self.BUCKETS, self.histograms[command]):
+                    cumulative += n
+                    le = "+Inf" if bound == float('inf') else bound
+                    lines.append(f'board_request_seconds_bucket{{command="{command}",le="{le}"}} {cumulative}')
+                lines.append(f'board_request_seconds_sum{{command="{command}"}} {self.latency_sums[command]:.6f}')
+                lines.append(f'board_request_seconds_count{{command="{command}"}} {cumulative}')
+        for name, value in extra.items():
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+# Serves the server's metrics as plaintext on every GET
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.board_server.metrics_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes are not worth a line on stdout each
+
+# Create a TCP socket bound to listen_ip:server_port. Exits if it cannot be bound.
+def create_server_socket(listen_ip, server_port):
+    print(f"Creating socket at port {server_port}.. ", end='')
+    try:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind((listen_ip, server_port))
+    except Exception as e:
+        print("Failure.\nERROR:\tFailed to create socket.")
+        print(e)
+        print("Terminating..")
+        exit()
+    print("Done.")
+    return server_socket
+
+# Connects one worker process to its siblings. Every board change a worker makes is published to
+# the others, which apply it to their own index and caches from a background thread.
+# Changes arrive asynchronously. Segment storage is shared, so GET_MESSAGES reads it for posts not yet
+# announced and is consistent across workers. With file storage a GET handled by another worker straight
+# after a POST may not include it until the change arrives, a moment later (eventual consistency).
+# Search results and subscriber pushes always follow the announcements.
+class ClusterLink:
+    def __init__(self, inbox, peers):
+        self.inbox = inbox # Queue of changes made by other workers
+        self.peers = peers # Inbox queues of every other worker
+
+    # Start applying changes from other workers with handler. Called in the worker process.
+    def start(self, handler):
+        for peer in self.peers:
+            peer.cancel_join_thread() # Never block exiting on a sibling that has stopped reading
+        threading.Thread(target=self._receive, args=(handler,), name="ClusterLink", daemon=True).start()
+
+    # Send a change to every other worker
+    def publish(self, event):
+        for peer in self.peers:
+            peer.put(event)
+
+    def _receive(self, handler):
+        while True:
+            event = self.inbox.get()
+            try:
+                handler(event)
+            except Exception as e:
+                print(f"ERROR:\tFailed to apply change from another worker {event}")
+                print(e)
+
+# One SUBSCRIBE connection. Posts are queued for it without blocking, and once its queue is full it is
+# dropped so a slow reader can never hold up the posters fanning out to it.
+class Subscriber:
+    def __init__(self, boards, max_queue, wake=None, on_drop=None):
+        self.boards = boards # Board titles subscribed to
+        self.queue = queue.Queue(max_queue) # (board title, message title, contents) waiting to be sent
+        self.wake = wake # Called after every push, from whichever thread pushed
+        self.on_drop = on_drop # Called once when dropped, to unblock a send stuck on the slow reader
+        self.dropped = False
+
+    # Queue a post for sending. Returns False if the subscriber has fallen too far behind.
+    def push(self, post):
+        try:
+            self.queue.put_nowait(post)
+        except queue.Full:
+            if not self.dropped:
+                self.dropped = True
+                if self.on_drop:
+                    self.on_drop()
+        if self.wake:
+            self.wake()
+        return not self.dropped
+
+# Fans every new post out to the subscribers of its board
+class SubscriptionHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.boards = {} # Board title -> set of subscribers
+
+    def subscribe(self, subscriber):
+        with self.lock:
+            for board_title in subscriber.boards:
+                self.boards.setdefault(board_title, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            for board_title in subscriber.boards:
+                subscribers = self.boards.get(board_title)
+                if subscribers:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self.boards[board_title]
+
+    # Returns True if anyone is subscribed to board_title, so posts nobody will see are never read back
+    def has_subscribers(self, board_title):
+        return board_title in self.boards
+
+    # Queue a post for every subscriber of its board, dropping those that have fallen behind
+    def publish(self, board_title, post):
+        with self.lock:
+            subscribers = list(self.boards.get(board_title, ()))
+        for subscriber in subscribers:
+            if not subscriber.push(post):
+                self.unsubscribe(subscriber)
+
+    # Returns a dict of counters describing the hub
+    def stats(self):
+        with self.lock:
+            return {"BOARDS": len(self.boards), "SUBSCRIBERS": len(set().union(*self.boards.values()))}
+
 class Server: # requires socket
-    def __init__(self, listen_ip, server_port, is_logging=True):
+    def __init__(self, listen_ip, server_port, is_logging=True, backlog=128, idle_timeout=30.0,
+                 message_cache_bytes=32 * 1024 * 1024, response_cache_bytes=16 * 1024 * 1024, logger=None, storage=None,
+                 server_socket=None, cluster=None, metrics_port=None, subscriber_queue=256, search=True,
+                 watch_boards=True, poll_interval=2.0, admin_token=None, rate_limiter=None, max_handlers=1024, max_waiting=1024, max_wait=5.0):
         self.server_port = server_port # Listening server port
         self.listen_ip = listen_ip # IP to listen on
         self.buffer_size = 4096 # Receive message buffer size
-        self._generate_board_list() # Generate dict of boards
-        self._bind() # Bind to server_port
-        self.logger = Logger("server.log") if is_logging else None # Create logger file
+        self.backlog = backlog # Number of pending connections the OS will queue for us
+        self.idle_timeout = idle_timeout # Seconds a connection may sit idle before we close it
+        self.storage = storage or FileStorage('./board/') # Where boards and their messages live
+        self.message_cache = LRUCache(message_cache_bytes) # (Board title, message ref) -> (title, contents)
+        self.response_cache = LRUCache(response_cache_bytes) # (Board title, encoding) -> (version, encoded GET_MESSAGES response)
+        self.server_socket = server_socket # Already bound when shared between worker processes
+        if not self.server_socket:
+            self._bind() # Bind to server_port
+        self.logger = (logger or Logger("server.log")) if is_logging else None # Create logger file
         self.lock = threading.Lock() # Threading lock. Keep contained in class for object reusabilitiy.
-
-    # Generates list of boards by reading all directories in board
-    def _generate_board_list(self):
-        self.board_list = {}
-        for root, dirs, _ in os.walk('./board/'):
-            for d in dirs:
-                self.board_list[f"{d}".replace('_', ' ')] = f"{root}{d}/"
-            break
+        self.metrics = Metrics() # Counters and latency histograms for GET_STATS and the metrics port
+        self.metrics_port = metrics_port # Port to serve plaintext metrics on, if any
+        self.cluster = cluster # Link to sibling worker processes, if any
+        self.hub = SubscriptionHub() # Connections waiting for new posts
+        self.subscriber_queue = subscriber_queue # Posts queued per subscriber before it is dropped
+        self.search_index = None # Token -> messages index, if searching is enabled
+        if search:
+            print("Building search index.. ", end='')
+            start = time.perf_counter()
+            self.search_index = SearchIndex()
+            self.search_index.build(self.storage, self.storage.read) # Bypasses the message cache so startup does not flood it
+            print(f"Done. {self.search_index.stats()['MESSAGES']} messages in {time.perf_counter() - start:.2f}s.")
+        self.rate_limiter = rate_limiter # Per client request limits, if any
+        self.max_handlers = max_handlers # Thread engine: most connections handled at once
+        self.max_waiting = max_waiting # Most connections queued for a handler before new ones are refused
+        self.admission_lock = threading.Lock()
+        self.active = 0 # Handler threads running
+        self.max_wait = max_wait # Seconds a connection may be queued before it is refused
+        self.waiting = collections.deque() # (Connection, deadline) queued for the next free handler, oldest first
+        self.refusals = queue.Queue(256) # Connections to be told the server is busy, by the refuser thread
+        self.admin_token = admin_token # Required by admin commands. Without one they are only accepted from loopback.
+        self.watcher = None # Follows boards being added and removed on disk, if enabled
+        if watch_boards:
+            self.watcher = BoardWatcher(self.storage.root, self._discover_boards, poll_interval)
+            self.watcher.start()
+            print(f"Watching {self.storage.root} for new boards using {self.watcher.method}.")
+        if self.cluster:
+            self.cluster.start(self._apply_remote)
 
     # Bind socket to server port
     def _bind(self):
-        print(f"Creating socket at port {self.server_port}.. ", end='')
+        self.server_socket = create_server_socket(self.listen_ip, self.server_port)
+
+    # Serve plaintext metrics on the side port from a background thread
+    def _start_metrics_server(self):
+        if not self.metrics_port:
+            return
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.bind((self.listen_ip, self.server_port))
+            self.metrics_server = http.server.ThreadingHTTPServer((self.listen_ip, self.metrics_port), MetricsHandler)
         except Exception as e:
-            print("Failure.\nERROR:\tFailed to create socket.")
+            print(f"ERROR:\tFailed to start metrics server on port {self.metrics_port}.")
             print(e)
-            print("Terminating..")
-            exit()
-        print("Done.")
+            return
+        self.metrics_server.daemon_threads = True
+        self.metrics_server.board_server = self
+        threading.Thread(target=self.metrics_server.serve_forever, name="MetricsServer", daemon=True).start()
+        print(f"Serving metrics on port {self.metrics_port}.")
+
+    # Returns the server's metrics, including cache counters, as plaintext
+    def metrics_text(self):
+        extra = {}
+        for name, cache in (("message", self.message_cache), ("response", self.response_cache)):
+            stats = cache.stats()
+            extra[f'board_cache_hits_total{{cache="{name}"}}'] = stats["HITS"]
+            extra[f'board_cache_misses_total{{cache="{name}"}}'] = stats["MISSES"]
+            extra[f'board_cache_evictions_total{{cache="{name}"}}'] = stats["EVICTIONS"]
+            extra[f'board_cache_bytes{{cache="{name}"}}'] = stats["BYTES"]
+        extra["board_boards"] = len(self.storage.board_titles())
+        return self.metrics.render_text(extra)
+
+    # Stop serving and flush the log
+    def close(self):
+        if self.watcher:
+            self.watcher.stop()
+        try:
+            self.server_socket.close()
+        except Exception:
+            pass
+        if getattr(self, "metrics_server", None):
+            self.metrics_server.shutdown()
+        if self.logger:
+            self.logger.close()
+        self.storage.close()
+
+    # Write a log entry if logging is enabled
+    def _log(self, command, success, address):
+        if self.logger:
+            self.logger.write(command, success, *address[:2])
+
+    # Encode a response for sending with codec, or as JSON on legacy connections.
+    # Responses served from the cache are already encoded.
+    def _encode(self, response, codec=None):
+        if isinstance(response, bytes):
+            return response
+        return (codec or protocol.JSON).dumps(response)
+
+    # Read a message's title and contents, going to storage only on a cache miss
+    def _read_message(self, board_title, ref):
+        message = self.message_cache.get((board_title, ref))
+        if message is None:
+            message = self.storage.read(board_title, ref)
+            self.message_cache.put((board_title, ref), message, len(message[0]) + len(message[1]))
+        return message
+
+    # Update caches, the search index and subscribers after a message was added to a board, by this process or another worker.
+    # A post from this process passes the message it wrote as (title, body), one from another worker is read back from storage.
+    def _message_added(self, board_title, ref, message=None):
+        self.message_cache.invalidate((board_title, ref)) # In case a message was rewritten
+        for encoding in protocol.Codec.ENCODINGS:
+            self.response_cache.invalidate((board_title, encoding))
+
+        subscribed = self.hub.has_subscribers(board_title)
+        if subscribed or self.search_index:
+            try:
+                message_title, f_contents = message or self._read_message(board_title, ref)
+                posted = self.storage.post_time(board_title, ref) if self.search_index else None
+            except Exception as e:
+                print(f"ERROR:\tFailed to read message {ref} from {board_title} for subscribers and search")
+                print(e)
+                return
+            if self.search_index:
+                self.search_index.add(board_title, ref, message_title, f_contents, posted)
+            if subscribed:
+                self.hub.publish(board_title, (board_title, message_title, f_contents))
+
+    # Pick up boards added to or removed from storage since we last looked
+    def _discover_boards(self):
+        added, removed = self.storage.discover()
+        for board_title in removed:
+            print(f"Board {board_title} was removed.")
+            for encoding in protocol.Codec.ENCODINGS:
+                self.response_cache.invalidate((board_title, encoding))
+            if self.search_index:
+                self.search_index.remove_board(board_title)
+        for board_title in added:
+            print(f"Found new board {board_title}.")
+            if self.search_index:
+                self.search_index.build(self.storage, self.storage.read, [board_title])
+
+    # Apply a change published by another worker process
+    def _apply_remote(self, event):
+        kind, board_title, ref = event
+        if kind == "APPEND" and self.storage.has_board(board_title):
+            self.storage.ingest(board_title, ref)
+            self._message_added(board_title, ref)
+        elif kind == "CREATE_BOARD": # Do not wait for our watcher to notice
+            self._discover_boards()
+
+    # Tell other worker processes about a change we made
+    def _publish(self, event):
+        if self.cluster:
+            self.cluster.publish(event)
+
+    # Returns True if a registered board is still on disk. Only used after a write fails, off the hot path.
+    # A board found missing is dropped straight away rather than waiting for the watcher.
+    def _board_exists(self, board_title):
+        if self.storage.board_exists(board_title):
+            return True
+        self._discover_boards()
+        return False
+
+    # Returns True if address may use admin commands given the token it sent
+    def _is_admin(self, address, token):
+        if self.admin_token:
+            return token == self.admin_token
+        return address[0] in ("127.0.0.1", "::1")
+
+    # Board names must survive being stored with underscores for spaces, and be safe as file names
+    BOARD_NAME = re.compile(r"[^\W_]([^\W_]|[ .-]){0,63}")
+
+    # Returns True if seconds since the epoch is finite and a date the platform's time functions accept,
+    # which file storage needs to turn SINCE into a file name
+    @staticmethod
+    def _valid_time(seconds):
+        try:
+            return math.isfinite(seconds) and bool(time.localtime(seconds))
+        except (OverflowError, OSError, ValueError): # Also raised for whole numbers too big for a float
+            return False
+
+    # Build a failure response and log the failed request
+    def _fail(self, command, address, message, code):
+        self._log(command, False, address)
+        return {"CODE": "FAIL", "ERROR_MESSAGE": message}, code
 
     # Start listening Loop and call functions to handle incoming requests
     def listen(self):
@@ -59,19 +697,26 @@ class Server: # requires socket
 
         print(f"Starting Server Listening.. ", end='')
         try:
-            self.server_socket.listen(1)
+            self.server_socket.listen(self.backlog)
         except Exception as e:
             print("Failure.\nERROR:\tFailed to start listening.")
             print(e)
             print("Terminating..")
             exit()
         print("Done.")
+        self._start_metrics_server()
+
+        # Wake up regularly so Ctrl+C is noticed even when the signal lands on another thread
+        self.server_socket.settimeout(1.0)
 
         # Loop indefinitely, accepting requests and handling them
         print("Entering Server Loop.")
         while True:
+            self._expire_waiting()
             try:
                 connection_socket, address = self.server_socket.accept()
+            except socket.timeout:
+                continue
             except Exception as e:
                 print("ERROR:\tFailed to accept connection!")
                 print(e)
@@ -79,32 +724,288 @@ class Server: # requires socket
 
             #self.lock.acquire()
             print(f"Received connection from {address}")
-            # Start new thread and handler. Send socket with it
-            _thread.start_new_thread(self._thread_handle, (connection_socket,))
+            # Start a new handler thread if we are under the limit, otherwise queue the connection for the
+            # next handler to finish. Once the queue is full too, refuse straight away.
+            with self.admission_lock:
+                if self.active < self.max_handlers:
+                    self.active += 1
+                    _thread.start_new_thread(self._thread_handle, (connection_socket,))
+                elif len(self.waiting) < self.max_waiting:
+                    self.waiting.append((connection_socket, time.monotonic() + self.max_wait))
+                else:
+                    self._refuse(connection_socket)
             print(f"Closed connection from {address}")
 
-    # Function called by start_new_thread.
+    # Function called by start_new_thread. Handles its connection, then any connections waiting for a handler.
+    # An error handling one connection is reported and the handler moves on, so it is never lost to the pool.
     def _thread_handle(self, socket):
-        code = self.handle(socket) # Handle request
-        if not code == "SUCCESS":
-            print(f"ERROR:\t\t{code}")
-        socket.close() # Close socket
+        while True:
+            self.metrics.connection_opened()
+            code = "ERROR_GENERIC"
+            try:
+                code = self.handle(socket) # Handle request
+                if not code == "SUCCESS":
+                    print(f"ERROR:\t\t{code}")
+            except Exception as e:
+                print("ERROR:\tFailed to handle connection!")
+                print(e)
+            finally:
+                socket.close() # Close socket
+                self.metrics.connection_closed(code)
+            with self.admission_lock:
+                self._expire_waiting_locked()
+                if not self.waiting:
+                    self.active -= 1
+                    return
+                socket, _ = self.waiting.popleft()
         #self.lock.release() # Release lock
 
-    # Function to handle incoming requests
+    # Refuse queued connections that have waited longer than max_wait. Handlers can all be held by
+    # long lived connections such as subscribers, so the accept loop calls this too rather than
+    # leaving the queue to whichever handler frees up next.
+    def _expire_waiting(self):
+        if self.waiting:
+            with self.admission_lock:
+                self._expire_waiting_locked()
+
+    # _expire_waiting for a caller already holding admission_lock
+    def _expire_waiting_locked(self):
+        now = time.monotonic()
+        while self.waiting and self.waiting[0][1] <= now: # Deadlines are in queueing order
+            self._refuse(self.waiting.popleft()[0])
+
+    # Returns a dict describing how many connections are being handled and waiting
+    def admission_stats(self):
+        return {"ACTIVE": self.active, "WAITING": len(self.waiting), "MAX_ACTIVE": self.max_handlers, "MAX_WAITING": self.max_waiting}
+
+    # Response sent to connections refused because every handler is busy and the wait queue is full
+    BUSY = {"CODE": "FAIL", "ERROR": "SERVER_BUSY", "ERROR_MESSAGE": "Server is too busy. Try again later"}
+
+    # Returns the BUSY response encoded for a connection whose first byte is first_byte
+    def _busy(self, first_byte):
+        if protocol.is_framed(first_byte):
+            return protocol.encode_frame(self.BUSY)
+        return json.dumps(self.BUSY).encode()
+
+    # Hand a connection to the refuser thread, which tells it we are busy without holding up accepting.
+    # If even that is backed up the connection is simply closed.
+    def _refuse(self, connection_socket):
+        if not getattr(self, "refuser", None):
+            self.refuser = threading.Thread(target=self._refuse_connections, name="Refuser", daemon=True)
+            self.refuser.start()
+        try:
+            self.refusals.put_nowait(connection_socket)
+        except queue.Full:
+            connection_socket.close()
+            self.metrics.connection_refused()
+
+    # Refuser thread. Waits briefly for each refused connection's request so the BUSY response can be
+    # sent in the format the client speaks. The request is read rather than peeked at, as closing a
+    # socket with unread data resets the connection and the client would never see the response.
+    def _refuse_connections(self):
+        while True:
+            connection_socket = self.refusals.get()
+            try:
+                connection_socket.settimeout(0.5)
+                first_bytes = connection_socket.recv(self.buffer_size)
+                connection_socket.sendall(self._busy(first_bytes[:1]))
+            except Exception:
+                pass
+            connection_socket.close()
+            self.metrics.connection_refused()
+
+    # Function to handle incoming requests on a blocking socket
     def handle(self, connection_socket):
+        # Peek at the first byte to tell framed connections from legacy single requests
+        try:
+            address = connection_socket.getpeername()
+            connection_socket.settimeout(self.idle_timeout)
+            first_byte = connection_socket.recv(1, socket.MSG_PEEK)
+        except socket.timeout as e:
+            print(f"ERROR:\tConnection timed out after {self.idle_timeout} seconds.")
+            return "CONNECTION_TIMEOUT"
+        except Exception as e:
+            print("ERROR:\tFailed to receive incoming connection.")
+            print(e)
+            return "ERROR_GENERIC"
+
+        if protocol.is_framed(first_byte):
+            return self._handle_framed(connection_socket, address)
+
         # Receive and split incoming message
         try:
             request = json.loads(connection_socket.recv(self.buffer_size).decode()) # Decode request
         except socket.timeout as e:
-            print("ERROR:\tConnection timed out after 10 seconds.")
+            print(f"ERROR:\tConnection timed out after {self.idle_timeout} seconds.")
             return "CONNECTION_TIMEOUT"
         except Exception as e:
             print("ERROR:\tFailed to receive incoming connection.")
             print(e)
             return "ERROR_GENERIC"
 
+        response, code = self.process(request, address)
+
+        # Encode and send response JSON
+        try:
+            connection_socket.send(self._encode(response))
+        except Exception as e:
+            print("ERROR:\tFailed to send response.")
+            print(e)
+            return "SEND_FAIL"
+        return code
+
+    # Serve length-prefixed requests on one connection until the client closes it or it goes idle.
+    # Every connection starts out as JSON and switches codec after a successful HELLO.
+    def _handle_framed(self, connection_socket, address):
+        codec = protocol.JSON
+        while True:
+            try:
+                request = protocol.recv_frame(connection_socket, codec)
+            except socket.timeout:
+                return "SUCCESS" # Idle connections are simply closed
+            except protocol.FrameError as e:
+                print("ERROR:\tInvalid frame received.")
+                print(e)
+                return "INVALID_FRAME"
+            except Exception as e:
+                print("ERROR:\tFailed to receive frame.")
+                print(e)
+                return "ERROR_GENERIC"
+
+            if request is None: # Client closed the connection
+                return "SUCCESS"
+
+            response, code = self.process(request, address, codec)
+            if not code == "SUCCESS":
+                print(f"ERROR:\t\t{code}")
+
+            # Subscribe before answering so no post made after the client sees SUCCESS is missed
+            subscriber = None
+            if code == "SUCCESS" and request.get("COMMAND") == "SUBSCRIBE":
+                subscriber = self._subscribe(request, codec, on_drop=lambda: self._shutdown(connection_socket))
+
+            try:
+                connection_socket.sendall(codec.frame(self._encode(response, codec)))
+            except Exception as e:
+                print("ERROR:\tFailed to send response.")
+                print(e)
+                if subscriber:
+                    self.hub.unsubscribe(subscriber)
+                return "SEND_FAIL"
+            codec = self._negotiated(request, response, code, codec)
+
+            if subscriber:
+                return self._stream(connection_socket, subscriber, codec)
+
+    # Stop all traffic on a socket, waking any thread blocked sending on it
+    def _shutdown(self, connection_socket):
+        try:
+            connection_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # Send a subscriber's posts as they arrive until it falls behind or the client goes away.
+    # The connection only pushes from here on. Requests are no longer read.
+    def _stream(self, connection_socket, subscriber, codec):
+        try:
+            while True:
+                try:
+                    event = self._push_event(subscriber.queue.get(timeout=self.idle_timeout), codec)
+                except queue.Empty:
+                    event = self.HEARTBEAT
+                if subscriber.dropped:
+                    print("ERROR:\tDropped subscriber that fell behind.")
+                    return "SLOW_SUBSCRIBER"
+                try:
+                    connection_socket.sendall(codec.frame(self._encode(event, codec)))
+                except Exception as e:
+                    if subscriber.dropped:
+                        print("ERROR:\tDropped subscriber that fell behind.")
+                        return "SLOW_SUBSCRIBER"
+                    print("ERROR:\tFailed to send to subscriber.")
+                    print(e)
+                    return "SEND_FAIL"
+        finally:
+            self.hub.unsubscribe(subscriber)
+
+    # Returns the codec a framed connection uses after answering request. The HELLO response is
+    # always sent with the old codec and everything after it with the one it announced.
+    def _negotiated(self, request, response, code, codec):
+        if code == "SUCCESS" and request.get("COMMAND") == "HELLO":
+            return protocol.Codec(response["ENCODING"], response["COMPRESSION"])
+        return codec
+
+    # Returns functions converting board titles to and from how a connection using codec carries them.
+    # JSON clients send and expect spaces as underscores. Binary clients use the titles as they are.
+    @staticmethod
+    def _wire_text(codec):
+        if codec and codec.encoding == "binary":
+            return (lambda text: text), (lambda text: text)
+        return (lambda text: text.replace(' ', '_')), (lambda text: text.replace('_', ' '))
+
+    # Returns functions converting message titles and bodies from how a connection using codec carries
+    # them to how they are stored, and back. Every message is stored with underscores for spaces, as
+    # boards always have been, whichever codec posted it. JSON clients are sent that form and turn it back
+    # themselves. Binary clients are sent spaces, so a message reads the same over either codec.
+    @staticmethod
+    def _message_text(codec):
+        store = lambda text: text.replace(' ', '_')
+        if codec and codec.encoding == "binary":
+            return store, (lambda text: text.replace('_', ' '))
+        return store, (lambda text: text)
+
+    # Returns the push frame sent to a subscriber for a post
+    def _push_event(self, post, codec):
+        to_wire, _ = self._wire_text(codec)
+        _, show = self._message_text(codec)
+        board_title, message_title, f_contents = post
+        return {"CODE": "SUCCESS", "EVENT": "MESSAGE", "BOARD": to_wire(board_title), "MESSAGE": (show(message_title), show(f_contents))}
+
+    # Returns a new subscriber for a successful SUBSCRIBE request, already registered with the hub
+    def _subscribe(self, request, codec, wake=None, on_drop=None):
+        _, from_wire = self._wire_text(codec)
+        subscriber = Subscriber({from_wire(b) for b in request["BOARDS"]}, self.subscriber_queue, wake, on_drop)
+        self.hub.subscribe(subscriber)
+        return subscriber
+
+    # Heartbeat sent to subscribers after idle_timeout seconds without a post, so dead peers are noticed
+    HEARTBEAT = {"CODE": "SUCCESS", "EVENT": "HEARTBEAT"}
+
+    # Commands the server understands. Anything else is counted as UNKNOWN in the metrics.
+    COMMANDS = ("GET_BOARDS", "GET_MESSAGES", "POST_MESSAGE", "POST_MESSAGES", "SEARCH", "GET_STATS", "HELLO", "SUBSCRIBE", "CREATE_BOARD")
+
+    # Most messages one POST_MESSAGES request may carry
+    MAX_BATCH = 10000
+
+    # Process a decoded request from address. Returns the response dict and a result code.
+    # Independent of the transport so every server engine shares the same semantics.
+    # codec is the connection's codec, or None for legacy single requests.
+    def process(self, request, address, codec=None):
+        start = time.perf_counter()
+        command = request.get("COMMAND") if isinstance(request, dict) else None
+        if not isinstance(command, str): # Malformed, and must not reach the rate limiter's buckets
+            command = None
+        retry_after = self.rate_limiter.check(address[0], command) if self.rate_limiter else 0
+        if retry_after:
+            print(f"ERROR\t\tRate limit exceeded by {address[0]}")
+            response, code = self._fail(command, address, "Rate limit exceeded", "RATE_LIMITED")
+            response["ERROR"] = "RATE_LIMITED" # Lets clients tell this apart from a bad request
+            response["RETRY_AFTER"] = round(retry_after, 3) # Seconds until a request would be allowed
+        else:
+            response, code = self._process(request, address, codec)
+        self.metrics.record(command if command in self.COMMANDS else "UNKNOWN", code, time.perf_counter() - start)
+        return response, code
+
+    # Carry out a single request
+    def _process(self, request, address, codec=None):
+        if not isinstance(request, dict) or not isinstance(request.get("COMMAND"), str):
+            print("ERROR:\t\tMalformed request!")
+            return self._fail(None, address, "Malformed request", "MALFORMED_REQUEST")
+
         response = {}
+        encoding = codec.encoding if codec else "json"
+        to_wire, from_wire = self._wire_text(codec) # For board titles
+        store, show = self._message_text(codec) # For message titles and bodies
 
         nb_req_fields = len(request) # For checking in nb. parameters correct
         command = request["COMMAND"] # Get type of request
@@ -113,170 +1014,703 @@ class Server: # requires socket
             # If invalid number of fields, return error
             if not nb_req_fields == 1:
                 print("ERROR:\t\tInvalid number of fields in request!")
-                response["CODE"] = "FAIL"
-                response["ERROR_MESSAGE"] = f"Invalid number of fields for GET_BOARDS. Expected 1 got {nb_req_fields}"
-                connection_socket.send(json.dumps(response).encode())
-                self.logger.write(command, False, *connection_socket.getpeername())
-                return "INVALID_NB_REQ"
+                return self._fail(command, address, f"Invalid number of fields for GET_BOARDS. Expected 1 got {nb_req_fields}", "INVALID_NB_REQ")
 
             response["CODE"] = "SUCCESS"
             # Iterate through board titles and add to response.
             response["BOARDS"] = []
-            for title in self.board_list:
-                response['BOARDS'].append(f"{title.replace(' ', '_')}")
+            for title in self.storage.board_titles():
+                response['BOARDS'].append(to_wire(title))
 
-            # Encode and send response JSON
-            connection_socket.send(json.dumps(response).encode())
-            self.logger.write(command, True, *connection_socket.getpeername())
-            return "SUCCESS"
+            self._log(command, True, address)
+            return response, "SUCCESS"
 
         elif command == "GET_MESSAGES": # If request is for getting all messages in a board
-            # If invalid number of fields, return error
-            if not nb_req_fields == 2:
+            # If missing the board or has fields other than the optional paging ones, return error
+            if not "BOARD" in request or not set(request) <= {"COMMAND", "BOARD", "LIMIT", "BEFORE", "SINCE"}:
                 print("ERROR\t\tInvalid number of fields in request!")
-                response["CODE"] = "FAIL"
-                response["ERROR_MESSAGE"] = f"Invalid number of fields for GET_MESSAGES. Expected 2 got {nb_req_fields}"
-                connection_socket.send(json.dumps(response).encode())
-                self.logger.write(command, False, *connection_socket.getpeername())
-                return "INVALID_NB_REQ"
+                return self._fail(command, address, "Invalid fields for GET_MESSAGES. Expected COMMAND, BOARD and optionally LIMIT, BEFORE, SINCE", "INVALID_NB_REQ")
+
+            # Paging fields are validated before anything else so bad requests fail fast
+            paged = nb_req_fields > 2
+            limit = request.get("LIMIT", 100)
+            since = request.get("SINCE")
+            if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1 or limit > 100:
+                print("ERROR\t\tInvalid LIMIT in request!")
+                return self._fail(command, address, "LIMIT must be a whole number from 1 to 100", "INVALID_FIELD")
+            if since is not None and (isinstance(since, bool) or not isinstance(since, (int, float))):
+                print("ERROR\t\tInvalid SINCE in request!")
+                return self._fail(command, address, "SINCE must be a time in seconds since the epoch", "INVALID_FIELD")
+            if since is not None and not self._valid_time(since):
+                print("ERROR\t\tInvalid SINCE in request!")
+                return self._fail(command, address, "SINCE must be a finite time within the range of dates the server can store", "INVALID_FIELD")
+            if not isinstance(request["BOARD"], str):
+                print("ERROR\t\tInvalid BOARD in request!")
+                return self._fail(command, address, "BOARD must be a board name", "INVALID_FIELD")
 
-            board_title = request["BOARD"].replace('_', ' ')
+            board_title = from_wire(request["BOARD"])
 
-            # If the board title is not in the list of boards, throw error
-            if not board_title in self.board_list:
+            # If the board title is not in the list of boards, throw error.
+            # The watcher keeps the list in step with the disk so there is no need to check the disk here.
+            if not self.storage.has_board(board_title):
                 print("ERROR\t\tRequested board does not exist")
-                response["CODE"] = "FAIL"
-                response["ERROR_MESSAGE"] = f"Requested board does not exist"
-                connection_socket.send(json.dumps(response).encode())
-                self.logger.write(command, False, *connection_socket.getpeername())
-                return "INVALID_NAME"
+                return self._fail(command, address, "Requested board does not exist", "INVALID_NAME")
+
+            # Pick up posts other workers have made, where storage can tell, so none is missed
+            self.storage.refresh(board_title)
+
+            # Serve the encoded response straight from the cache if the board has not changed since.
+            # Only the default (unpaged) request is cached.
+            if not paged:
+                version = self.storage.version(board_title)
+                cached = self.response_cache.get((board_title, encoding))
+                if cached and cached[0] == version:
+                    self._log(command, True, address)
+                    return cached[1], "SUCCESS"
 
             response["CODE"] = "SUCCESS"
             response["MESSAGES"] = [] #  Array of (title, message) tuples
 
-            # If the board is missing when it should exist, throw error
-            if not os.path.isdir(f"./{self.board_list[board_title]}"):
-                print("ERROR\t\tRequested board is missing")
-                response["CODE"] = "FAIL"
-                response["ERROR_MESSAGE"] = f"Requested board is missing"
-                connection_socket.send(json.dumps(response).encode())
-                self.logger.write(command, False, *connection_socket.getpeername())
-                return "MISSING_BOARD"
-
-            for root, _, files in os.walk(f"./{self.board_list[board_title]}"):
-                # Strips /, returns last portion (to get file name), splits by - and returns date, before rejoining.
-                # Gets time value in milliseconds and uses to sort in reverse order
+            # Read the newest matching messages straight from the index
+            try:
+                version, refs, cursor, latest = self.storage.page(board_title, limit, request.get("BEFORE"), since)
+            except ValueError as e:
+                print("ERROR\t\tInvalid BEFORE in request!")
+                return self._fail(command, address, "BEFORE must be a CURSOR from an earlier response", "INVALID_FIELD")
+            for ref in refs:
+                # Get message and add to response.
                 try:
-                    files.sort(key=lambda x: time.strptime('-'.join(x.split('/')[-1].split('-')[:2]), "%Y%m%d-%H%M%S"), reverse=True)
-                except:
-                    # If not in specified format
-                    print("ERROR:\t\tInvalid message title format")
-                    response["CODE"] = "FAIL"
-                    response["ERROR_MESSAGE"] = "Invalid message title format"
-                    connection_socket.send(json.dumps(response).encode())
-                    self.logger.write(command, False, *connection_socket.getpeername())
-                    return "INVALID_MESSAGE"
-
-                for i, f in enumerate(files):
-                    if i > 99: # Only print first 100
-                        break
-                    # Open file and add contents to response. Then close file.
-                    try:
-                        f = f"{root}{f}"
-                        fh = open(f)
-                        f_contents = fh.read()
-                        fh.close()
-                    except:
-                        print("ERROR:\tFailed to read file {root}{f}")
-                        print(e)
-                        continue
+                    message_title, f_contents = self._read_message(board_title, ref)
+                except Exception as e:
+                    print(f"ERROR:\tFailed to read message {ref} from {board_title}")
+                    print(e)
+                    continue
+
+                response["MESSAGES"].append((show(message_title), show(f_contents)))
 
-                    message_title = f.split('-')[2] # Append title before contents delimited with '-'
-                    response["MESSAGES"].append((message_title.replace(' ', '_'), f_contents.replace(' ', '_')))           
+            # Paged requests get what they need to ask for the next page, or for newer messages
+            if paged:
+                response["CURSOR"] = cursor # Pass as BEFORE for older messages. None when there are none left
+                # Pass as SINCE for newer messages. With file storage the page repeats messages from
+                # the LATEST second, so nothing posted later in that second is missed.
+                response["LATEST"] = latest if refs else since
+                self._log(command, True, address)
+                return response, "SUCCESS"
 
-            # Encode and send response JSON
-            connection_socket.send(json.dumps(response).encode())
-            self.logger.write(command, True, *connection_socket.getpeername())
-            return "SUCCESS"
+            # Cache the encoded response tagged with the version it was built from.
+            # A post racing with us bumps the version so a stale entry is never served.
+            encoded = self._encode(response, codec)
+            self.response_cache.put((board_title, encoding), (version, encoded), len(encoded))
+
+            self._log(command, True, address)
+            return encoded, "SUCCESS"
 
         elif command == "POST_MESSAGE": # If request is for posting a message to a given board
             # If invalid number of fields, throw error
             if not nb_req_fields == 4:
                 print("ERROR\t\tInvalid number of fields in request!")
-                response["CODE"] = "FAIL"
-                response["ERROR_MESSAGE"] = f"Invalid number of fields for POST_MESSAGE. Expected 4 got {nb_req_fields}"
-                
-                connection_socket.send(json.dumps(response).encode())
-                self.logger.write(command, False, *connection_socket.getpeername())
-                return "INVALID_NB_REQ"
+                return self._fail(command, address, f"Invalid number of fields for POST_MESSAGE. Expected 4 got {nb_req_fields}", "INVALID_NB_REQ")
+            if not all(isinstance(request.get(field), str) for field in ("BOARD", "TITLE", "MESSAGE")):
+                print("ERROR\t\tInvalid fields in request!")
+                return self._fail(command, address, "POST_MESSAGE needs BOARD, TITLE and MESSAGE as text", "INVALID_FIELD")
 
-            board_title = request["BOARD"].replace('_', ' ')
+            board_title = from_wire(request["BOARD"])
 
             # If board not in board list, throw error
-            if not board_title in self.board_list:
+            if not self.storage.has_board(board_title):
                 print("ERROR\t\tRequested board does not exist")
-                response["CODE"] = "FAIL"
-                response["ERROR_MESSAGE"] = f"Requested board does not exist"
-                connection_socket.send(json.dumps(response).encode())
-                self.logger.write(command, False, *connection_socket.getpeername())
-                return "INVALID_NAME"
-
-            # If board is missing when it should exist, throw error
-            if not os.path.isdir(f"./{self.board_list[board_title]}"):
-                print("ERROR\t\tRequested board is missing")
-                response["CODE"] = "FAIL"
-                response["ERROR_MESSAGE"] = f"Requested board is missing"
-                connection_socket.send(json.dumps(response).encode())
-                self.logger.write(command, False, *connection_socket.getpeername())
-                return "MISSING_BOARD"
+                return self._fail(command, address, "Requested board does not exist", "INVALID_NAME")
 
             response["CODE"] = "SUCCESS"
-            message_title = request["TITLE"].replace(' ', '_')
-            message = request["MESSAGE"].replace(' ', '_') 
+            message_title = store(request["TITLE"])
+            message = store(request["MESSAGE"])
+            if not self.storage.valid_title(message_title):
+                print("ERROR\t\tInvalid TITLE in request!")
+                return self._fail(command, address, "TITLE cannot contain path separators or NUL, or be too long", "INVALID_FIELD")
 
-            # Format filename as requested
-            file_time = time.strftime("%Y%m%d-%H%M%S")
-            file_name = f"{file_time}-{message_title}"
+            # Write the message to the board's storage
+            try:
+                ref = self.storage.append(board_title, message_title, message)
+            except Exception as e:
+                # Only now check whether the board was removed before the watcher noticed
+                if not self._board_exists(board_title):
+                    print("ERROR\t\tRequested board is missing")
+                    return self._fail(command, address, "Requested board is missing", "MISSING_BOARD")
+                print(f"ERROR:\tFailed to write message to {board_title}")
+                print(e)
+                return {"CODE": "FAIL", "ERROR_MESSAGE": "Failed to write message!"}, "WRITE_FAIL"
+
+            self._message_added(board_title, ref, (message_title, message))
+            self._publish(("APPEND", board_title, ref))
+
+            self._log(command, True, address)
+            return response, "SUCCESS"
+
+        elif command == "POST_MESSAGES": # If request is for posting many messages, to any boards, at once
+            messages = request.get("MESSAGES")
+            if not nb_req_fields == 2 or not isinstance(messages, list) or not messages:
+                print("ERROR\t\tInvalid fields in request!")
+                return self._fail(command, address, "Invalid fields for POST_MESSAGES. Expected COMMAND and a non-empty MESSAGES list", "INVALID_FIELD")
+            if len(messages) > self.MAX_BATCH:
+                print("ERROR\t\tToo many messages in request!")
+                return self._fail(command, address, f"POST_MESSAGES takes at most {self.MAX_BATCH} messages, got {len(messages)}", "INVALID_FIELD")
+
+            # Check every entry and group the valid ones by board, keeping their order
+            results = [None] * len(messages)
+            batches = {} # Board title -> list of (index into messages, message title, message)
+            for i, entry in enumerate(messages):
+                if not isinstance(entry, list) or not len(entry) == 3 or not all(isinstance(field, str) for field in entry):
+                    results[i] = {"CODE": "FAIL", "ERROR": "INVALID_FIELD", "ERROR_MESSAGE": "Expected [BOARD, TITLE, MESSAGE]"}
+                    continue
+                board_title = from_wire(entry[0])
+                if not self.storage.has_board(board_title):
+                    results[i] = {"CODE": "FAIL", "ERROR": "INVALID_NAME", "ERROR_MESSAGE": "Requested board does not exist"}
+                    continue
+                if not self.storage.valid_title(store(entry[1])):
+                    results[i] = {"CODE": "FAIL", "ERROR": "INVALID_FIELD", "ERROR_MESSAGE": "TITLE cannot contain path separators or NUL, or be too long"}
+                    continue
+                batches.setdefault(board_title, []).append((i, store(entry[1]), store(entry[2])))
+
+            # Commit each board's messages together: one write and one sync per board rather than per message
+            for board_title, batch in batches.items():
+                try:
+                    refs = self.storage.append_batch(board_title, [(message_title, message) for _, message_title, message in batch])
+                except Exception as e:
+                    if not self._board_exists(board_title):
+                        for i, _, _ in batch:
+                            results[i] = {"CODE": "FAIL", "ERROR": "MISSING_BOARD", "ERROR_MESSAGE": "Requested board is missing"}
+                        continue
+                    print(f"ERROR:\tFailed to write messages to {board_title}")
+                    print(e)
+                    for i, _, _ in batch:
+                        results[i] = {"CODE": "FAIL", "ERROR": "WRITE_FAIL", "ERROR_MESSAGE": "Failed to write message!"}
+                    continue
+                for (i, message_title, message), ref in zip(batch, refs):
+                    results[i] = {"CODE": "SUCCESS"}
+                    self._message_added(board_title, ref, (message_title, message))
+                    self._publish(("APPEND", board_title, ref))
+
+            response["CODE"] = "SUCCESS" # Per message outcomes are in RESULTS, in request order
+            response["RESULTS"] = results
+
+            self._log(command, True, address)
+            return response, "SUCCESS"
+
+        elif command == "SEARCH": # If request is for the messages containing every word of a query
+            if not "QUERY" in request or not set(request) <= {"COMMAND", "QUERY", "BOARD", "LIMIT"}:
+                print("ERROR\t\tInvalid number of fields in request!")
+                return self._fail(command, address, "Invalid fields for SEARCH. Expected COMMAND, QUERY and optionally BOARD, LIMIT", "INVALID_NB_REQ")
+            if not self.search_index:
+                print("ERROR\t\tSearch is disabled!")
+                return self._fail(command, address, "Search is disabled on this server", "SEARCH_DISABLED")
+
+            query = request["QUERY"]
+            limit = request.get("LIMIT", 20)
+            if not isinstance(query, str) or not query.strip():
+                print("ERROR\t\tInvalid QUERY in request!")
+                return self._fail(command, address, "QUERY must be some text to search for", "INVALID_FIELD")
+            if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1 or limit > 100:
+                print("ERROR\t\tInvalid LIMIT in request!")
+                return self._fail(command, address, "LIMIT must be a whole number from 1 to 100", "INVALID_FIELD")
+
+            board_titles = None # Every board
+            if "BOARD" in request:
+                board_title = from_wire(request["BOARD"]) if isinstance(request["BOARD"], str) else None
+                if not self.storage.has_board(board_title):
+                    print("ERROR\t\tRequested board does not exist")
+                    return self._fail(command, address, "Requested board does not exist", "INVALID_NAME")
+                board_titles = [board_title]
+
+            response["CODE"] = "SUCCESS"
+            response["RESULTS"] = [] # Array of (board, title, message) tuples
+            for board_title, ref in self.search_index.search(query, board_titles, limit):
+                try:
+                    message_title, f_contents = self._read_message(board_title, ref)
+                except Exception as e:
+                    print(f"ERROR:\tFailed to read message {ref} from {board_title}")
+                    print(e)
+                    continue
+                response["RESULTS"].append((to_wire(board_title), show(message_title), show(f_contents)))
+
+            self._log(command, True, address)
+            return response, "SUCCESS"
+
+        elif command == "CREATE_BOARD": # If request is for a new, empty board. Admin only.
+            if not "BOARD" in request or not set(request) <= {"COMMAND", "BOARD", "TOKEN"}:
+                print("ERROR\t\tInvalid number of fields in request!")
+                return self._fail(command, address, "Invalid fields for CREATE_BOARD. Expected COMMAND, BOARD and optionally TOKEN", "INVALID_NB_REQ")
+            if not self._is_admin(address, request.get("TOKEN")):
+                print("ERROR\t\tCREATE_BOARD without admin rights!")
+                return self._fail(command, address, "CREATE_BOARD needs a valid admin TOKEN", "NOT_ADMIN")
+
+            board_title = from_wire(request["BOARD"]) if isinstance(request["BOARD"], str) else ""
+            if not self.BOARD_NAME.fullmatch(board_title) or board_title.endswith(' '):
+                print("ERROR\t\tInvalid board name!")
+                return self._fail(command, address, "Board names are up to 64 letters, digits, spaces, '.' and '-', starting with a letter or digit", "INVALID_FIELD")
+            if self.storage.has_board(board_title):
+                print("ERROR\t\tBoard already exists!")
+                return self._fail(command, address, "Requested board already exists", "BOARD_EXISTS")
 
-            # Create and write message to file. Then close.
             try:
-                # Could be susceptible to directory traversal
-                fh = open(f"{self.board_list[board_title]}{file_name}", mode='w')
-                fh.write(message)
-                fh.close()
+                self.storage.create_board(board_title)
+            except FileExistsError:
+                self._discover_boards() # Created on disk before the watcher told us
+                print("ERROR\t\tBoard already exists!")
+                return self._fail(command, address, "Requested board already exists", "BOARD_EXISTS")
             except Exception as e:
-                print(f"ERROR:\tFailed to write to file {self.board_list[board_title]}{file_name}")
+                print(f"ERROR:\tFailed to create board {board_title}")
                 print(e)
-                response["CODE"] = "FAIL"
-                response["ERROR_MESSAGE"] = f"Failed to write message!"
-                connection_socket.send(json.dumps(response).encode())
-                return "WRITE_FAIL"
+                return {"CODE": "FAIL", "ERROR_MESSAGE": "Failed to create board!"}, "WRITE_FAIL"
+            self._publish(("CREATE_BOARD", board_title, None))
+
+            response["CODE"] = "SUCCESS"
+            response["BOARD"] = to_wire(board_title)
+
+            self._log(command, True, address)
+            return response, "SUCCESS"
+
+        elif command == "GET_STATS": # If request is for the server's metrics
+            if not nb_req_fields == 1:
+                print("ERROR:\t\tInvalid number of fields in request!")
+                return self._fail(command, address, f"Invalid number of fields for GET_STATS. Expected 1 got {nb_req_fields}", "INVALID_NB_REQ")
+
+            response["CODE"] = "SUCCESS"
+            response["STATS"] = self.metrics.snapshot()
+            response["STATS"]["CACHES"] = {"MESSAGE": self.message_cache.stats(), "RESPONSE": self.response_cache.stats()}
+            response["STATS"]["BOARDS"] = len(self.storage.board_titles())
+            response["STATS"]["SUBSCRIPTIONS"] = self.hub.stats()
+            response["STATS"]["SEARCH"] = self.search_index.stats() if self.search_index else None
+            response["STATS"]["ADMISSION"] = self.admission_stats()
+            response["STATS"]["RATE_LIMITS"] = self.rate_limiter.stats() if self.rate_limiter else None
+
+            self._log(command, True, address)
+            return response, "SUCCESS"
+
+        elif command == "HELLO": # If request is negotiating the encoding of a framed connection
+            if not codec:
+                print("ERROR\t\tHELLO on a legacy connection!")
+                return self._fail(command, address, "HELLO is only supported on framed connections", "NOT_FRAMED")
+            offered = request.get("ENCODINGS", [])
+            compressions = request.get("COMPRESSION", [])
+            if not set(request) <= {"COMMAND", "ENCODINGS", "COMPRESSION"} or not isinstance(offered, list) or not isinstance(compressions, list):
+                print("ERROR\t\tInvalid fields in request!")
+                return self._fail(command, address, "Invalid fields for HELLO. Expected COMMAND and optionally ENCODINGS, COMPRESSION lists", "INVALID_FIELD")
+
+            # Choose our most preferred option the client also supports. JSON is always available.
+            response["CODE"] = "SUCCESS"
+            response["ENCODING"] = protocol.choose(offered, protocol.Codec.ENCODINGS) or "json"
+            response["COMPRESSION"] = protocol.choose(compressions, protocol.Codec.COMPRESSIONS)
 
-            # Encode and send response JSON
-            connection_socket.send(json.dumps(response).encode())
-            self.logger.write(command, True, *connection_socket.getpeername())
-            return "SUCCESS"
+            self._log(command, True, address)
+            return response, "SUCCESS"
+
+        elif command == "SUBSCRIBE": # If request is to be sent every new post to some boards
+            if not codec:
+                print("ERROR\t\tSUBSCRIBE on a legacy connection!")
+                return self._fail(command, address, "SUBSCRIBE is only supported on framed connections", "NOT_FRAMED")
+            boards = request.get("BOARDS")
+            if not nb_req_fields == 2 or not isinstance(boards, list) or not boards or not all(isinstance(b, str) for b in boards):
+                print("ERROR\t\tInvalid fields in request!")
+                return self._fail(command, address, "Invalid fields for SUBSCRIBE. Expected COMMAND and a non-empty BOARDS list", "INVALID_FIELD")
+
+            for board in boards:
+                if not self.storage.has_board(from_wire(board)):
+                    print("ERROR\t\tRequested board does not exist")
+                    return self._fail(command, address, f"Requested board {board} does not exist", "INVALID_NAME")
+
+            # The connection registers with the hub and starts streaming once this response is sent
+            response["CODE"] = "SUCCESS"
+            response["BOARDS"] = boards
+
+            self._log(command, True, address)
+            return response, "SUCCESS"
 
         else: # If the request command is not recognised
             print("ERROR\t\tRequested Command does not exist")
-            response["CODE"] = "FAIL"
-            response["ERROR_MESSAGE"] = f"Requested command does not exist"
-            connection_socket.send(json.dumps(response).encode())
-            self.logger.write(command, False, *connection_socket.getpeername())
-            return "UNKNOWN_COMMAND"
+            return self._fail(command, address, "Requested command does not exist", "UNKNOWN_COMMAND")
+
+# Server engine built on asyncio streams. One coroutine per connection instead of one thread,
+# so a single process can hold many thousands of concurrent connections.
+class AsyncServer(Server):
+    def __init__(self, listen_ip, server_port, max_connections=10000, **kwargs):
+        self.max_connections = max_connections # Maximum number of connections served at once
+        super().__init__(listen_ip, server_port, **kwargs)
+
+    # Raise the soft open file limit to the hard limit so we can hold lots of sockets
+    def _raise_fd_limit(self):
+        if resource is None:
+            return
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft < hard:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except Exception as e:
+            print("ERROR:\tFailed to raise open file limit.")
+            print(e)
+
+    def admission_stats(self):
+        return {"ACTIVE": getattr(self, "nb_active", 0), "WAITING": getattr(self, "nb_waiting", 0),
+                "MAX_ACTIVE": self.max_connections, "MAX_WAITING": self.max_waiting}
+
+    # Start the event loop and serve until interrupted
+    def listen(self):
+        if not self.server_socket: # Check if socket exists
+            print("ERROR:\t\tSocket not bound! Terminating!")
+            exit()
+
+        self._raise_fd_limit()
+        self._start_metrics_server()
+        asyncio.run(self._serve())
+
+    # Start serving on the already bound socket
+    async def _serve(self):
+        self.semaphore = asyncio.Semaphore(self.max_connections) # Bound concurrently served connections
+        self.nb_waiting = 0 # Connections waiting on the semaphore
+        self.nb_active = 0 # Connections holding the semaphore
+
+        print(f"Starting Async Server Listening.. ", end='')
+        try:
+            server = await asyncio.start_server(self._async_handle, sock=self.server_socket, backlog=self.backlog)
+        except Exception as e:
+            print("Failure.\nERROR:\tFailed to start listening.")
+            print(e)
+            print("Terminating..")
+            exit()
+        print("Done.")
+
+        print("Entering Server Loop.")
+        async with server:
+            await server.serve_forever()
+
+    # Coroutine called for every accepted connection. Waits up to max_wait seconds for a free slot if
+    # max_connections are already being served, or is refused straight away if max_waiting connections
+    # are waiting already.
+    async def _async_handle(self, reader, writer):
+        if self.semaphore.locked():
+            if self.nb_waiting >= self.max_waiting:
+                await self._async_refuse(reader, writer)
+                return
+            self.nb_waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                await self._async_refuse(reader, writer)
+                return
+            finally:
+                self.nb_waiting -= 1
+        else:
+            await self.semaphore.acquire()
+
+        self.nb_active += 1
+        try:
+            self.metrics.connection_opened()
+            code = "ERROR_GENERIC"
+            try:
+                code = await self.async_handle(reader, writer)
+                if not code == "SUCCESS":
+                    print(f"ERROR:\t\t{code}")
+            finally:
+                self.metrics.connection_closed(code)
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except Exception:
+                    pass
+        finally:
+            self.nb_active -= 1
+            self.semaphore.release()
+
+    # Asyncio equivalent of _refuse_connections for one connection
+    async def _async_refuse(self, reader, writer):
+        try:
+            first_bytes = await asyncio.wait_for(reader.read(self.buffer_size), 0.5) # Read, not just the first byte, as in _refuse_connections
+            writer.write(self._busy(first_bytes[:1]))
+            await writer.drain()
+        except Exception:
+            pass
+        writer.close()
+        self.metrics.connection_refused()
+
+    # Commands answered from memory alone, which are cheap enough to run on the event loop
+    INLINE_COMMANDS = ("GET_BOARDS", "GET_STATS", "HELLO", "SUBSCRIBE")
+
+    # Returns True if a request can be answered without touching storage: a malformed or unknown one,
+    # an INLINE_COMMANDS one, or an unpaged GET_MESSAGES whose encoded response is cached and current
+    def _in_memory(self, request, codec):
+        command = request.get("COMMAND") if isinstance(request, dict) else None
+        if command in self.INLINE_COMMANDS or not command in self.COMMANDS:
+            return True
+        if command == "GET_MESSAGES" and set(request) == {"COMMAND", "BOARD"} and isinstance(request["BOARD"], str):
+            _, from_wire = self._wire_text(codec)
+            board_title = from_wire(request["BOARD"])
+            if self.storage.refresh(board_title): # Another worker posted, so the cache is stale
+                return False
+            cached = self.response_cache.peek((board_title, codec.encoding if codec else "json")) # process counts the lookup
+            return bool(cached) and cached[0] == self.storage.version(board_title)
+        return False
+
+    # Process a request without blocking the event loop. Anything that may read or write storage runs on
+    # the default thread pool, so one slow disk read or fsync does not stall every other connection.
+    # process is thread safe as the thread engine already relies on it.
+    async def _async_process(self, request, address, codec=None):
+        if self._in_memory(request, codec):
+            return self.process(request, address, codec)
+        return await asyncio.get_running_loop().run_in_executor(None, self.process, request, address, codec)
+
+    # Asyncio equivalent of handle
+    async def async_handle(self, reader, writer):
+        try:
+            address = writer.get_extra_info('peername')
+            first_byte = await asyncio.wait_for(reader.read(1), self.idle_timeout)
+            if protocol.is_framed(first_byte):
+                return await self._async_handle_framed(reader, writer, address, first_byte)
+            data = first_byte + await asyncio.wait_for(reader.read(self.buffer_size - 1), self.idle_timeout)
+            request = json.loads(data.decode()) # Decode request
+        except asyncio.TimeoutError:
+            print(f"ERROR:\tConnection timed out after {self.idle_timeout} seconds.")
+            return "CONNECTION_TIMEOUT"
+        except Exception as e:
+            print("ERROR:\tFailed to receive incoming connection.")
+            print(e)
+            return "ERROR_GENERIC"
+
+        response, code = await self._async_process(request, address)
+
+        # Encode and send response JSON
+        try:
+            writer.write(self._encode(response))
+            await writer.drain()
+        except Exception as e:
+            print("ERROR:\tFailed to send response.")
+            print(e)
+            return "SEND_FAIL"
+        return code
+
+    # Asyncio equivalent of _handle_framed. first_byte is the part of the first header already read.
+    async def _async_handle_framed(self, reader, writer, address, first_byte):
+        prefix = first_byte
+        codec = protocol.JSON
+        while True:
+            try:
+                request = await asyncio.wait_for(protocol.read_frame(reader, prefix, codec), self.idle_timeout)
+            except asyncio.TimeoutError:
+                return "SUCCESS" # Idle connections are simply closed
+            except protocol.FrameError as e:
+                print("ERROR:\tInvalid frame received.")
+                print(e)
+                return "INVALID_FRAME"
+            except Exception as e:
+                print("ERROR:\tFailed to receive frame.")
+                print(e)
+                return "ERROR_GENERIC"
+            prefix = b''
+
+            if request is None: # Client closed the connection
+                return "SUCCESS"
+
+            response, code = await self._async_process(request, address, codec)
+            if not code == "SUCCESS":
+                print(f"ERROR:\t\t{code}")
+
+            # Subscribe before answering so no post made after the client sees SUCCESS is missed.
+            # Posts from other workers arrive on another thread, so pushes wake us through the loop.
+            subscriber = None
+            if code == "SUCCESS" and request.get("COMMAND") == "SUBSCRIBE":
+                loop = asyncio.get_running_loop()
+                ready = asyncio.Event()
+                subscriber = self._subscribe(request, codec, lambda: loop.call_soon_threadsafe(ready.set),
+                                             lambda: loop.call_soon_threadsafe(writer.transport.abort))
+
+            try:
+                writer.write(codec.frame(self._encode(response, codec)))
+                await writer.drain()
+            except Exception as e:
+                print("ERROR:\tFailed to send response.")
+                print(e)
+                if subscriber:
+                    self.hub.unsubscribe(subscriber)
+                return "SEND_FAIL"
+            codec = self._negotiated(request, response, code, codec)
+
+            if subscriber:
+                return await self._async_stream(writer, subscriber, ready, codec)
+
+    # Asyncio equivalent of _stream. ready is set whenever a post is pushed to the subscriber.
+    async def _async_stream(self, writer, subscriber, ready, codec):
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(ready.wait(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                ready.clear()
+                if subscriber.dropped:
+                    print("ERROR:\tDropped subscriber that fell behind.")
+                    return "SLOW_SUBSCRIBER"
+
+                events = []
+                while True:
+                    try:
+                        events.append(self._push_event(subscriber.queue.get_nowait(), codec))
+                    except queue.Empty:
+                        break
+                try:
+                    for event in events or [self.HEARTBEAT]:
+                        writer.write(codec.frame(self._encode(event, codec)))
+                    await writer.drain()
+                except Exception as e:
+                    if subscriber.dropped:
+                        print("ERROR:\tDropped subscriber that fell behind.")
+                        return "SLOW_SUBSCRIBER"
+                    print("ERROR:\tFailed to send to subscriber.")
+                    print(e)
+                    return "SEND_FAIL"
+        finally:
+            self.hub.unsubscribe(subscriber)
+
+# Build the logger, storage and server described by the command line arguments
+def build_server(args, server_socket=None, cluster=None, worker=0):
+    logger = None
+    if not args.no_log:
+        logger = Logger(args.log_file, buffered=args.log_buffered, batch_size=args.log_batch_size,
+                        flush_interval=args.log_flush_interval, max_bytes=args.log_max_bytes, backup_count=args.log_backups,
+                        rotate=worker == 0) # Workers share the log, so only the first rotates it
+
+    durability = {"durability": args.durability, "fsync_interval": args.fsync_interval / 1000}
+    if args.storage == "segment":
+        storage = SegmentStorage(args.board_dir or './segments/', use_mmap=args.mmap, shared=args.workers > 1, **durability)
+    else:
+        storage = FileStorage(args.board_dir or './board/', **durability)
+
+    # Initialise Server object
+    options = {"storage": storage, "is_logging": logger is not None, "backlog": args.backlog, "idle_timeout": args.idle_timeout,
+               "message_cache_bytes": args.message_cache_bytes, "response_cache_bytes": args.response_cache_bytes, "logger": logger,
+               "server_socket": server_socket, "cluster": cluster, "subscriber_queue": args.subscriber_queue, "search": not args.no_search,
+               "watch_boards": not args.no_watch, "poll_interval": args.poll_interval, "admin_token": args.admin_token,
+               "max_handlers": args.max_handlers, "max_waiting": args.max_waiting, "max_wait": args.max_wait,
+               "metrics_port": args.metrics_port + worker if args.metrics_port else None} # One metrics port per worker
+    if args.rate_limit or args.command_rate_limit:
+        options["rate_limiter"] = RateLimiter(args.rate_limit, dict(args.command_rate_limit))
+    if args.engine == "async":
+        return AsyncServer(args.ip, args.port, max_connections=args.max_connections, **options)
+    return Server(args.ip, args.port, **options)
+
+# Signal handler for workers. Ctrl+C reaches workers both from the terminal and from the parent,
+# so stop listening for signals on the first one to let shutdown run uninterrupted.
+def _stop_worker(signum, frame):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+# Entry point of a worker process. Serves on the inherited socket until told to stop.
+def run_worker(args, server_socket, cluster, worker):
+    signal.signal(signal.SIGINT, _stop_worker)
+    signal.signal(signal.SIGTERM, _stop_worker)
+    server = build_server(args, server_socket, cluster, worker)
+    try:
+        server.listen()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close() # Processes started by multiprocessing skip atexit, so flush here
+
+# Start worker number i, linked to every other worker's inbox
+def _start_worker(context, args, server_socket, inboxes, i):
+    cluster = ClusterLink(inboxes[i], inboxes[:i] + inboxes[i + 1:])
+    worker = context.Process(target=run_worker, args=(args, server_socket, cluster, i), name=f"worker-{i}")
+    worker.start()
+    return worker
+
+# Pre-fork nb_workers processes that all accept on one listening socket, so request handling is
+# spread across cores. The parent only supervises: it restarts workers that die and stops them all
+# on SIGINT or SIGTERM.
+def run_workers(args, nb_workers):
+    server_socket = create_server_socket(args.ip, args.port)
+    server_socket.listen(args.backlog)
+    context = multiprocessing.get_context("fork") # Workers inherit the listening socket
+    inboxes = [context.Queue() for _ in range(nb_workers)]
+    workers = [_start_worker(context, args, server_socket, inboxes, i) for i in range(nb_workers)]
+    print(f"Started {nb_workers} workers.")
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while True:
+            time.sleep(1)
+            for i, worker in enumerate(workers):
+                if not worker.is_alive():
+                    print(f"ERROR:\tWorker {i} exited with code {worker.exitcode}. Restarting..")
+                    workers[i] = _start_worker(context, args, server_socket, inboxes, i)
+    except KeyboardInterrupt:
+        print("\nShutting down workers..")
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate() # SIGTERM, which workers treat like Ctrl+C
+        for worker in workers:
+            worker.join(10)
+            if worker.is_alive():
+                worker.kill()
+        server_socket.close()
 
 if __name__ == '__main__':
-    if not len(sys.argv) == 3:
-        print("Incorrect Syntax!")
-        print("Usage: python server.py IP PORT")
-
-    # Get sys args and cast to type
-    ip_address = sys.argv[1]
-    port = int(sys.argv[2])
-    if port < 1 or port > 65535:
+    parser = argparse.ArgumentParser(description="Message board server.", usage="python server.py IP PORT [options]")
+    parser.add_argument("ip", help="IP address to listen on")
+    parser.add_argument("port", type=int, help="Port to listen on")
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread", help="Server engine to use (default: thread)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes sharing the listening socket (default: 1). Boards read the same from every worker with "
+                             "segment storage. With file storage a post reaches other workers a moment later, and SEARCH results always do")
+    parser.add_argument("--backlog", type=int, default=1024, help="Listen backlog of pending connections (default: 1024)")
+    parser.add_argument("--max-connections", type=int, default=10000, help="Async engine: maximum connections served concurrently (default: 10000)")
+    parser.add_argument("--max-handlers", type=int, default=1024, help="Thread engine: maximum connections handled concurrently (default: 1024)")
+    parser.add_argument("--max-waiting", type=int, default=1024,
+                        help="Connections queued for a free handler before new ones are refused with SERVER_BUSY (default: 1024)")
+    parser.add_argument("--max-wait", type=float, default=5.0,
+                        help="Seconds a queued connection waits for a free handler before it is refused with SERVER_BUSY (default: 5)")
+    parser.add_argument("--rate-limit", type=RateLimiter.parse, metavar="RATE[:BURST]",
+                        help="Requests per second allowed from each client IP by each worker, with an optional burst. Excess requests fail with RATE_LIMITED")
+    parser.add_argument("--command-rate-limit", type=RateLimiter.parse_command, action="append", default=[], metavar="COMMAND=RATE[:BURST]",
+                        help="Requests per second allowed from each client IP for one command. May be repeated")
+    parser.add_argument("--idle-timeout", type=float, default=30.0, help="Seconds before an idle connection is closed (default: 30)")
+    parser.add_argument("--message-cache-bytes", type=int, default=32 * 1024 * 1024, help="Size of the message body cache, 0 to disable (default: 32MiB)")
+    parser.add_argument("--response-cache-bytes", type=int, default=16 * 1024 * 1024, help="Size of the encoded GET_MESSAGES response cache, 0 to disable (default: 16MiB)")
+    parser.add_argument("--log-file", default="server.log", help="File to log requests to (default: server.log)")
+    parser.add_argument("--no-log", action="store_true", help="Disable request logging")
+    parser.add_argument("--log-buffered", action="store_true", help="Write the log in batches from a background thread")
+    parser.add_argument("--log-batch-size", type=int, default=256, help="Buffered log: most lines per write (default: 256)")
+    parser.add_argument("--log-flush-interval", type=float, default=1.0, help="Buffered log: seconds between flushes (default: 1)")
+    parser.add_argument("--log-max-bytes", type=int, default=0, help="Rotate the log once it reaches this size, 0 to never rotate (default: 0)")
+    parser.add_argument("--log-backups", type=int, default=5, help="Number of rotated logs to keep (default: 5)")
+    parser.add_argument("--storage", choices=["file", "segment"], default="file", help="Board storage backend (default: file)")
+    parser.add_argument("--board-dir", help="Directory holding the boards (default: ./board/ for file, ./segments/ for segment)")
+    parser.add_argument("--mmap", action="store_true", help="Segment storage: serve reads from memory-mapped segments")
+    parser.add_argument("--durability", choices=["none", "batch", "always"], default="batch",
+                        help="When posts are synced to disk: never, in the background every --fsync-interval, or before every post returns (default: batch). "
+                             "With file storage, batch still syncs each message's data before the post returns and only leaves the directory to the background")
+    parser.add_argument("--fsync-interval", type=float, default=50, help="Batch durability: milliseconds between syncs (default: 50)")
+    parser.add_argument("--subscriber-queue", type=int, default=256, help="Posts queued for a SUBSCRIBE connection before it is dropped as too slow (default: 256)")
+    parser.add_argument("--no-search", action="store_true", help="Do not build the search index. SEARCH requests fail")
+    parser.add_argument("--no-watch", action="store_true", help="Only find boards at startup instead of watching for new and removed ones")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between checks for board changes when inotify is unavailable (default: 2)")
+    parser.add_argument("--admin-token", help="Token admin commands such as CREATE_BOARD must send. Without one they are only accepted from loopback")
+    parser.add_argument("--metrics-port", type=int, help="Serve plaintext metrics on this port. Worker N uses this port + N")
+    args = parser.parse_args()
+
+    if args.port < 1 or args.port > 65535:
         print("ERROR:\tPort must be in range 0-65535.")
         print("Terminating..")
         exit()
 
-    server = Server(ip_address, port) # Initialise Server object
-    server.listen() # Call main Server function
\ No newline at end of file
+    if args.workers > 1:
+        run_workers(args, args.workers)
+        exit()
+
+    server = build_server(args)
+
+    # Treat SIGTERM like Ctrl+C so we always shut down cleanly
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.listen() # Call main Server function
+    except KeyboardInterrupt:
+        print("\nShutting down..")
+    finally:
+        server.close()
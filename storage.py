@@ -0,0 +1,738 @@
+import os # For getting list of dirs and files
+import sys # Get system arguments.
+import time # For getting time for filename generation
+import struct # For packing segment record headers
+import zlib # For record checksums
+import bisect # For keeping the board index sorted
+import threading # For locking boards against concurrent writers
+import argparse # For parsing command line options
+import mmap # For optionally memory-mapping segments
+import tempfile # For writing messages to a temporary name first
+from array import array # Compact offset index
+
+try:
+    import fcntl # For locking segments shared between worker processes (Unix only)
+except ImportError:
+    fcntl = None
+
+# Board storage backends. Both expose the same interface so the server does not care which is used:
+#   board_titles(), has_board(title), board_exists(title), version(title),
+#   latest(title, count) -> (version, refs newest first), read(title, ref) -> (message title, body),
+#   page(title, count, before, since) -> (version, refs newest first, cursor, latest),
+#   append(title, message title, body) -> ref, ingest(title, ref), close(),
+#   append_batch(title, [(message title, body), ...]) -> refs, written and synced to disk together, flush(),
+#   discover() -> (titles added, titles removed), create_board(title), refresh(title),
+#   valid_title(message title) -> whether append and append_batch accept it, else they raise ValueError,
+#   post_time(title, ref) -> when the message was posted
+# A ref identifies one message within a board. Titles use spaces, names on disk use underscores.
+# Paging cursors are the ref of the oldest message returned, and times are seconds since the epoch.
+# A page since a time holds the messages posted after it. FileStorage only knows post times to the
+# second, so its pages since a time also hold the rest of that second: a message posted later in the
+# same second as the newest one a poller saw is sent rather than missed, and the poller drops repeats.
+# ingest is used by worker processes to pick up a message another worker appended to the same board.
+# refresh does the same before a read, where the backend can tell cheaply, so a read never misses a post
+# another worker has already acknowledged. Only SegmentStorage can: with FileStorage posts by other
+# workers become visible when their ingest arrives, a moment later.
+# discover rescans only the top of root, indexing boards that appeared and forgetting those that went,
+# so the board list can follow changes on disk without a restart.
+#
+# Durability is chosen when a backend is created and applies to append and append_batch alike:
+#   "none"   - never fsync. A crash of the machine may lose recent posts, and with FileStorage may
+#              leave a recent message empty or cut short under its final name.
+#   "batch"  - a background thread fsyncs everything written in the last fsync_interval seconds,
+#              so posts return without waiting for the disk and at most that long is at risk.
+#              FileStorage still syncs each message's data before naming it, leaving only the
+#              directory to the background, so a message that survives a crash is complete.
+#   "always" - fsync before a post returns. Slowest, but nothing acknowledged is ever lost.
+# A message is never served half written while the machine stays up: FileStorage writes each message
+# to a temporary file and links it into place, and SegmentStorage checksums every record. Recovery at
+# startup removes what a crash left behind, temporary files and partial or corrupt trailing records.
+DURABILITY = ("none", "batch", "always")
+
+# Common board registry shared by the backends
+class Storage:
+    def __init__(self, root, durability="batch", fsync_interval=0.05):
+        if not durability in DURABILITY:
+            raise ValueError(f"Unknown durability mode {durability}")
+        self.root = root if root.endswith('/') else f"{root}/" # Directory holding every board
+        self.lock = threading.Lock() # Posts and reads come from many handler threads
+        self.board_list = {} # Board title -> location on disk
+        self.versions = {} # Board title -> number of changes, so cached reads can tell if they are stale
+        self.durability = durability # One of DURABILITY
+        self.fsync_interval = fsync_interval # Batch durability: seconds between background fsyncs
+        self.sync_lock = threading.Lock() # Guards unsynced
+        self.unsynced = set() # Batch durability: what has been written but not yet synced
+        self.stopped = threading.Event()
+        self.syncer = None
+        if durability == "batch":
+            self.syncer = threading.Thread(target=self._sync_loop, name="StorageSync", daemon=True)
+            self.syncer.start()
+
+    # Titles of every board
+    def board_titles(self):
+        return list(self.board_list)
+
+    # Returns True if a board with this title is registered
+    def has_board(self, board_title):
+        return board_title in self.board_list
+
+    # Returns True if a message may have this title. Any text will do unless the backend says otherwise.
+    def valid_title(self, message_title):
+        return True
+
+    # Returns the current version of a board
+    def version(self, board_title):
+        with self.lock:
+            return self.versions.get(board_title, 0)
+
+    # Returns the newest count refs, and the board version they were read at
+    def latest(self, board_title, count=100):
+        version, refs, _, _ = self.page(board_title, count)
+        return version, refs
+
+    # Mark a board as changed. Caller holds self.lock.
+    def _bump(self, board_title):
+        self.versions[board_title] = self.versions.get(board_title, 0) + 1
+
+    # Generates list of boards from what is in root
+    def _generate_board_list(self):
+        self.board_list = self._scan()
+
+    # Bring the board list in line with root. Returns the titles of boards added and removed.
+    def discover(self):
+        found = self._scan()
+        with self.lock:
+            added = [title for title in found if not title in self.board_list]
+            removed = [title for title in self.board_list if not title in found]
+        for board_title in added:
+            self._add_board(board_title, found[board_title])
+        for board_title in removed:
+            self._remove_board(board_title)
+        return added, removed
+
+    # Pick up messages other processes appended to a board. Returns True if there were any.
+    def refresh(self, board_title):
+        return False
+
+    # Create a new empty board. Raises FileExistsError if it is already there.
+    def create_board(self, board_title):
+        path = self._board_path(board_title)
+        self._create(path)
+        self._add_board(board_title, path)
+
+    # Record that items were written. They are synced straight away, by the next background sync or
+    # never, depending on the durability mode. What an item is depends on the backend's _sync.
+    def _written(self, items):
+        if self.durability == "always":
+            self._sync(items)
+        elif self.durability == "batch":
+            with self.sync_lock:
+                self.unsynced.update(items)
+
+    # Sync everything written since the last sync
+    def flush(self):
+        with self.sync_lock:
+            items = self.unsynced
+            self.unsynced = set()
+        if items:
+            try:
+                self._sync(items)
+            except Exception as e:
+                print("ERROR:\tFailed to sync storage to disk")
+                print(e)
+
+    def _sync_loop(self):
+        while not self.stopped.wait(self.fsync_interval):
+            self.flush()
+
+    # Stop the background sync and sync whatever is left
+    def close(self):
+        self.stopped.set()
+        if self.syncer:
+            self.syncer.join()
+        self.flush()
+
+# In-memory index of the message files in every board, each list kept sorted oldest to newest.
+# Message files are named {YYYYmmdd-HHMMSS}-{title}, or {YYYYmmdd-HHMMSS}.{n}-{title} for a repeated
+# title within a second, so sorting the names sorts them by time,
+# which means the timestamps only need parsing once when a board is first indexed.
+class BoardIndex:
+    def __init__(self, board_list):
+        self.messages = {} # Board title -> sorted list of message file names
+        for board_title, path in board_list.items():
+            self.add_board(board_title, path)
+
+    # Scan a board directory once and index every correctly named message
+    def add_board(self, board_title, path):
+        files = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if not entry.is_file() or entry.name.startswith(TEMP_PREFIX): # Messages still being written
+                        continue
+                    try:
+                        time.strptime(entry.name[:15], "%Y%m%d-%H%M%S")
+                    except ValueError:
+                        print(f"ERROR:\t\tInvalid message title format {path}{entry.name}. Skipping.")
+                        continue
+                    files.append(entry.name)
+        except Exception as e:
+            print(f"ERROR:\tFailed to index board {path}")
+            print(e)
+        files.sort()
+        self.messages[board_title] = files
+
+    # Record a newly written message file
+    def add(self, board_title, file_name):
+        files = self.messages.setdefault(board_title, [])
+        i = bisect.bisect_left(files, file_name)
+        if i == len(files) or not files[i] == file_name: # Rewriting an existing name does not add a message
+            files.insert(i, file_name)
+
+    # Returns up to count message file names from a board, newest first, that sort before the before
+    # name and were posted in or after the second of the since time. Also returns whether older matching
+    # names remain.
+    def page(self, board_title, count=100, before=None, since=None):
+        files = self.messages.get(board_title, [])
+        hi = len(files) if before is None else bisect.bisect_left(files, before)
+        lo = 0
+        if since is not None:
+            # Names posted in the since second start with it, so sort from "{since second}" onwards
+            lo = bisect.bisect_left(files, time.strftime("%Y%m%d-%H%M%S", time.localtime(since)))
+        start = max(lo, hi - count)
+        return files[start:hi][::-1], start > lo
+
+# Messages are written to a file named {TEMP_PREFIX}{pid}-... in their board, then linked into place
+TEMP_PREFIX = ".tmp-"
+
+# Returns True if a process with this pid is running
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Running, but as someone else
+        return True
+    return True
+
+# The original layout: one directory per board under root, one file per message named {time}-{title}.
+# Refs are message file names. Post times only have a resolution of one second.
+class FileStorage(Storage):
+    def __init__(self, root='./board/', durability="batch", fsync_interval=0.05):
+        super().__init__(root, durability, fsync_interval)
+        umask = os.umask(0) # Read the umask, which can only be done by setting it
+        os.umask(umask)
+        self.file_mode = 0o666 & ~umask # Mode message files get, as if created with open()
+        self._generate_board_list() # Generate dict of boards
+        self._recover()
+        self.board_index = BoardIndex(self.board_list) # Index every board's messages once up front
+
+    # Remove temporary files left by processes that crashed part way through writing a message.
+    # Other workers may be writing right now, so only files of processes that are gone are removed.
+    def _recover(self):
+        removed = 0
+        for path in self.board_list.values():
+            try:
+                with os.scandir(path) as entries:
+                    names = [entry.name for entry in entries if entry.name.startswith(TEMP_PREFIX)]
+            except OSError:
+                continue
+            for name in names:
+                pid = name[len(TEMP_PREFIX):].split('-', 1)[0]
+                if pid.isdigit() and _process_alive(int(pid)) and not int(pid) == os.getpid():
+                    continue
+                try:
+                    os.remove(f"{path}{name}")
+                    removed += 1
+                except OSError as e:
+                    print(f"ERROR:\tFailed to remove partial message {path}{name}")
+                    print(e)
+        if removed:
+            print(f"Recovery removed {removed} partially written messages.")
+
+    # Returns every board directory in root by title
+    def _scan(self):
+        boards = {}
+        for root, dirs, _ in os.walk(self.root):
+            for d in dirs:
+                boards[f"{d}".replace('_', ' ')] = f"{root}{d}/"
+            break
+        return boards
+
+    def _board_path(self, board_title):
+        return f"{self.root}{board_title.replace(' ', '_')}/"
+
+    def _create(self, path):
+        os.mkdir(path)
+
+    # Index a board found on disk and make it visible
+    def _add_board(self, board_title, path):
+        index = BoardIndex({})
+        index.add_board(board_title, path) # Scan outside the lock
+        with self.lock:
+            if board_title in self.board_list:
+                return
+            self.board_index.messages[board_title] = index.messages[board_title]
+            self.board_list[board_title] = path
+            self._bump(board_title)
+
+    def _remove_board(self, board_title):
+        with self.lock:
+            self.board_list.pop(board_title, None)
+            self.board_index.messages.pop(board_title, None)
+            self._bump(board_title)
+
+    # Returns True if the board's directory is still on disk
+    def board_exists(self, board_title):
+        return os.path.isdir(self.board_list[board_title])
+
+    def page(self, board_title, count=100, before=None, since=None):
+        if before is not None and not isinstance(before, str):
+            raise ValueError(f"Invalid cursor {before}")
+        with self.lock:
+            version = self.versions.get(board_title, 0)
+            refs, more = self.board_index.page(board_title, count, before, since)
+        latest = self.post_time(board_title, refs[0]) if refs else None
+        return version, refs, refs[-1] if more else None, latest
+
+    def read(self, board_title, ref):
+        fh = open(f"{self.board_list[board_title]}{ref}")
+        contents = fh.read()
+        fh.close()
+        return ref.split('-', 2)[2], contents # Title follows the timestamp, delimited with '-'
+
+    def post_time(self, board_title, ref):
+        return time.mktime(time.strptime(ref[:15], "%Y%m%d-%H%M%S"))
+
+    # Titles are part of file names, so they cannot hold path separators or NUL, or make a name too long
+    # for the file system even with the counter _place may add
+    def valid_title(self, message_title):
+        if any(sep and sep in message_title for sep in (os.sep, os.altsep, '\0')):
+            return False
+        return len(f"{time.strftime('%Y%m%d-%H%M%S')}.0000-{message_title}".encode()) <= 255
+
+    # Write a message to a temporary file in the board directory. Returns its path.
+    def _write_temp(self, path, message):
+        fd, temp_path = tempfile.mkstemp(prefix=f"{TEMP_PREFIX}{os.getpid()}-", dir=path)
+        try:
+            if hasattr(os, "fchmod"): # mkstemp creates files readable only by us
+                os.fchmod(fd, self.file_mode)
+            os.write(fd, message.encode())
+            if not self.durability == "none":
+                os.fsync(fd) # The data must be on disk before the name is
+        except BaseException:
+            os.close(fd)
+            os.remove(temp_path)
+            raise
+        os.close(fd)
+        return temp_path
+
+    # Give a written temporary file its final name and return that name. Messages with the same title
+    # posted in the same second would share {time}-{title}, so later ones are named {time}.{n}-{title}
+    # instead of replacing the first. Linking fails when the name is taken, even by another worker.
+    # The temporary file is removed whether or not linking succeeds.
+    def _place(self, path, temp_path, file_time, message_title):
+        n = 1
+        try:
+            while True:
+                file_name = f"{file_time}-{message_title}" if n == 1 else f"{file_time}.{n:04d}-{message_title}"
+                try:
+                    os.link(temp_path, f"{path}{file_name}")
+                    return file_name
+                except FileExistsError:
+                    n += 1
+        finally:
+            os.remove(temp_path)
+
+    # Sync board directories, making the names of messages linked into them durable.
+    # Message data is synced by _write_temp before the message is linked.
+    def _sync(self, paths):
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError: # Board removed since
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def append(self, board_title, message_title, message):
+        if not self.valid_title(message_title): # Would escape the board directory or fail to link
+            raise ValueError(f"Invalid message title {message_title}")
+        # Format filename as requested
+        file_time = time.strftime("%Y%m%d-%H%M%S")
+
+        # Write the message under a temporary name then link it into place, so a crash part way
+        # through never leaves a truncated message
+        path = self.board_list[board_title]
+        file_name = self._place(path, self._write_temp(path, message), file_time, message_title)
+        self._written([path]) # Only the directory is left to sync, the data was synced before linking
+
+        with self.lock:
+            self.board_index.add(board_title, file_name) # Make the message visible to readers
+            self._bump(board_title)
+        return file_name
+
+    # Write every message, then link them all into place before any becomes visible.
+    # Each message is its own file so each needs its data synced, but the directory is synced once
+    # for the whole batch. If any message fails none is kept: what was written or linked is removed.
+    def append_batch(self, board_title, messages):
+        for message_title, _ in messages:
+            if not self.valid_title(message_title):
+                raise ValueError(f"Invalid message title {message_title}")
+        file_time = time.strftime("%Y%m%d-%H%M%S")
+        path = self.board_list[board_title]
+        temp_paths = []
+        file_names = []
+        try:
+            for message_title, message in messages:
+                temp_paths.append(self._write_temp(path, message))
+            for temp_path, (message_title, _) in zip(temp_paths, messages):
+                file_names.append(self._place(path, temp_path, file_time, message_title))
+        except BaseException:
+            for leftover in temp_paths[len(file_names):] + [f"{path}{file_name}" for file_name in file_names]:
+                try:
+                    os.remove(leftover)
+                except FileNotFoundError: # The temporary file of the message that failed to link
+                    pass
+            raise
+        self._written([path])
+
+        with self.lock:
+            for file_name in file_names:
+                self.board_index.add(board_title, file_name)
+            self._bump(board_title)
+        return file_names
+
+    def ingest(self, board_title, ref):
+        with self.lock:
+            self.board_index.add(board_title, ref)
+            self._bump(board_title)
+
+# Each record in a segment is a header followed by the UTF-8 title and body.
+# The header holds a CRC32 of everything after it, the post time and the title and body lengths.
+RECORD_HEADER = struct.Struct('>IdHI')
+
+# One append-only segment file per board, root/{Board_Name}.seg. Posts are sequential appends and
+# an in-memory offset index, rebuilt by scanning record headers at startup, turns reads into a single
+# positioned read (or a slice of a memory map). Refs are record offsets within the segment.
+# With shared set, appends take a file lock so several worker processes can write the same segments.
+class SegmentStorage(Storage):
+    def __init__(self, root='./segments/', use_mmap=False, shared=False, durability="batch", fsync_interval=0.05):
+        super().__init__(root, durability, fsync_interval)
+        self.use_mmap = use_mmap # Serve reads from a memory map instead of pread
+        self.shared = shared and fcntl is not None # Other processes may append to our segments
+        self.files = {} # Board title -> file descriptor opened for appending and reading
+        self.offsets = {} # Board title -> array of record offsets, oldest first
+        self.stamps = {} # Board title -> array of record post times, oldest first
+        self.ends = {} # Board title -> offset just past the last complete record
+        self.maps = {} # Board title -> mmap of the segment, remapped as it grows
+        os.makedirs(self.root, exist_ok=True)
+        self._generate_board_list() # Generate dict of boards
+        for board_title in self.board_list:
+            self._open_board(board_title)
+
+    # Returns every segment file in root by title
+    def _scan(self):
+        boards = {}
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith('.seg'):
+                boards[name[:-4].replace('_', ' ')] = f"{self.root}{name}"
+        return boards
+
+    def _board_path(self, board_title):
+        return f"{self.root}{board_title.replace(' ', '_')}.seg"
+
+    def _create(self, path):
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+
+    # Open a segment found on disk and make it visible
+    def _add_board(self, board_title, path):
+        with self.lock:
+            if board_title in self.board_list:
+                return
+            self.board_list[board_title] = path
+            self._open_board(board_title)
+            self._bump(board_title)
+
+    def _remove_board(self, board_title):
+        with self.lock:
+            self.board_list.pop(board_title, None)
+            mapped = self.maps.pop(board_title, None)
+            if mapped is not None:
+                mapped.close()
+            fd = self.files.pop(board_title, None)
+            if fd is not None:
+                os.close(fd)
+            self.offsets.pop(board_title, None)
+            self.stamps.pop(board_title, None)
+            self.ends.pop(board_title, None)
+            self._bump(board_title)
+
+    # Open a board's segment and build its offset index
+    def _open_board(self, board_title):
+        path = self.board_list[board_title]
+        fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self.files[board_title] = fd
+        self.offsets[board_title] = array('q')
+        self.stamps[board_title] = array('d')
+        self.ends[board_title] = 0
+        if self.shared:
+            fcntl.flock(fd, fcntl.LOCK_EX) # No other process is part way through an append while we check
+        try:
+            self._recover(board_title)
+        finally:
+            if self.shared:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    # Index every record in a segment, checking each one's checksum as it goes, and truncate the
+    # segment at the first record that is incomplete or corrupt. Only the tail can be damaged by a
+    # crash, as records are only ever appended. Reads the segment in large sequential chunks.
+    def _recover(self, board_title):
+        fd = self.files[board_title]
+        offsets = self.offsets[board_title]
+        stamps = self.stamps[board_title]
+        size = os.fstat(fd).st_size
+        offset = 0
+        buffer = b''
+        position = 0 # Where offset is within buffer
+        while offset + RECORD_HEADER.size <= size:
+            if len(buffer) - position < RECORD_HEADER.size:
+                buffer = buffer[position:] + os.pread(fd, 1 << 20, offset + len(buffer) - position)
+                position = 0
+            crc, stamp, title_length, body_length = RECORD_HEADER.unpack_from(buffer, position)
+            length = RECORD_HEADER.size + title_length + body_length
+            if offset + length > size: # Partially written record
+                break
+            if len(buffer) - position < length:
+                buffer = buffer[position:] + os.pread(fd, max(1 << 20, length), offset + len(buffer) - position)
+                position = 0
+            if not zlib.crc32(memoryview(buffer)[position + 4:position + length]) == crc: # Torn or corrupt record
+                break
+            offsets.append(offset)
+            stamps.append(stamp)
+            offset += length
+            position += length
+        self.ends[board_title] = offset
+        if offset < size:
+            print(f"ERROR:\t\tDiscarding {size - offset} bytes of partial or corrupt records at the end of {self.board_list[board_title]}")
+            os.ftruncate(fd, offset)
+            os.fsync(fd)
+
+    # Index any complete records past the end of what we have indexed so far. Caller holds self.lock
+    # (or is still constructing). Returns True if anything new was found.
+    def _catch_up(self, board_title):
+        fd = self.files[board_title]
+        offsets = self.offsets[board_title]
+        stamps = self.stamps[board_title]
+        size = os.fstat(fd).st_size
+        offset = start = self.ends[board_title]
+        while offset + RECORD_HEADER.size <= size:
+            _, stamp, title_length, body_length = RECORD_HEADER.unpack(os.pread(fd, RECORD_HEADER.size, offset))
+            record_end = offset + RECORD_HEADER.size + title_length + body_length
+            if record_end > size: # Partially written record
+                break
+            offsets.append(offset)
+            stamps.append(stamp)
+            offset = record_end
+        self.ends[board_title] = offset
+        return offset > start
+
+    # Returns True if the board's segment is still on disk
+    def board_exists(self, board_title):
+        return os.path.isfile(self.board_list[board_title])
+
+    def page(self, board_title, count=100, before=None, since=None):
+        if before is not None and not isinstance(before, int):
+            raise ValueError(f"Invalid cursor {before}")
+        with self.lock:
+            offsets = self.offsets.get(board_title, array('q'))
+            stamps = self.stamps.get(board_title, array('d'))
+            hi = len(offsets) if before is None else bisect.bisect_left(offsets, before)
+            lo = 0 if since is None else bisect.bisect_right(stamps, since)
+            start = max(lo, hi - count)
+            refs = offsets[start:hi][::-1].tolist()
+            return self.versions.get(board_title, 0), refs, refs[-1] if start > lo else None, stamps[hi - 1] if refs else None
+
+    def post_time(self, board_title, ref):
+        with self.lock:
+            offsets = self.offsets[board_title]
+            i = bisect.bisect_left(offsets, ref)
+            if i == len(offsets) or not offsets[i] == ref:
+                raise KeyError(f"No message at offset {ref}")
+            return self.stamps[board_title][i]
+
+    # Read the raw bytes of the record at offset
+    def _read_record(self, board_title, offset):
+        with self.lock:
+            offsets = self.offsets[board_title]
+            i = bisect.bisect_left(offsets, offset)
+            if i == len(offsets) or not offsets[i] == offset:
+                raise KeyError(f"No message at offset {offset}")
+            end = offsets[i + 1] if i + 1 < len(offsets) else self.ends[board_title]
+            fd = self.files[board_title]
+
+            if self.use_mmap:
+                mapped = self.maps.get(board_title)
+                if mapped is None or len(mapped) < end: # Map (again) now the segment has grown
+                    if mapped is not None:
+                        mapped.close()
+                    mapped = mmap.mmap(fd, self.ends[board_title], access=mmap.ACCESS_READ)
+                    self.maps[board_title] = mapped
+                return mapped[offset:end]
+
+        return os.pread(fd, end - offset, offset) # Records are immutable so no need to hold the lock
+
+    # Split a record into its post time, title and body
+    def _decode_record(self, record):
+        _, stamp, title_length, _ = RECORD_HEADER.unpack_from(record)
+        title_end = RECORD_HEADER.size + title_length
+        return stamp, record[RECORD_HEADER.size:title_end].decode(), record[title_end:].decode()
+
+    def read(self, board_title, ref):
+        _, message_title, message = self._decode_record(self._read_record(board_title, ref))
+        return message_title, message
+
+    # Build the bytes for one record
+    # Record headers hold the title's length in two bytes
+    def valid_title(self, message_title):
+        return len(message_title.encode()) <= 0xFFFF
+
+    def _encode_record(self, stamp, message_title, message):
+        title = message_title.encode()
+        body = message.encode()
+        tail = struct.pack('>dHI', stamp, len(title), len(body)) + title + body
+        return struct.pack('>I', zlib.crc32(tail)) + tail
+
+    def append(self, board_title, message_title, message, stamp=None):
+        with self.lock:
+            fd = self.files[board_title]
+            if self.shared:
+                fcntl.flock(fd, fcntl.LOCK_EX) # Hold off other processes until our record is in
+            try:
+                if self.shared:
+                    self._catch_up(board_title) # Index what other processes appended so our offset is right
+                stamps = self.stamps[board_title]
+                stamp = time.time() if stamp is None else stamp
+                if stamps and stamp < stamps[-1]: # Keep post times in append order even if the clock steps back
+                    stamp = stamps[-1]
+                record = self._encode_record(stamp, message_title, message)
+                offset = self.ends[board_title]
+                os.write(fd, record) # One sequential append
+            finally:
+                if self.shared:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            self.offsets[board_title].append(offset)
+            stamps.append(stamp)
+            self.ends[board_title] = offset + len(record)
+            self._bump(board_title)
+        self._written([board_title])
+        return offset
+
+    # Append every message with a single write and a single fsync
+    def append_batch(self, board_title, messages):
+        with self.lock:
+            fd = self.files[board_title]
+            if self.shared:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if self.shared:
+                    self._catch_up(board_title)
+                stamps = self.stamps[board_title]
+                stamp = time.time()
+                if stamps and stamp < stamps[-1]:
+                    stamp = stamps[-1]
+                records = [self._encode_record(stamp, message_title, message) for message_title, message in messages]
+                offset = self.ends[board_title]
+                os.write(fd, b''.join(records)) # Group commit, synced once below
+            finally:
+                if self.shared:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            refs = []
+            for record in records:
+                refs.append(offset)
+                self.offsets[board_title].append(offset)
+                stamps.append(stamp)
+                offset += len(record)
+            self.ends[board_title] = offset
+            self._bump(board_title)
+        self._written([board_title])
+        return refs
+
+    # Sync the segments of boards. The descriptors are duplicated so a board removed meanwhile
+    # cannot close them underneath us, and the lock is not held while the disk works.
+    def _sync(self, board_titles):
+        with self.lock:
+            fds = [os.dup(self.files[board_title]) for board_title in board_titles if board_title in self.files]
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    # Another process appended to this board. Everything up to its record is complete, so just catch up.
+    def ingest(self, board_title, ref):
+        self.refresh(board_title)
+
+    # Only shared segments can be appended to by anyone else. Costs one fstat.
+    def refresh(self, board_title):
+        if not self.shared:
+            return False
+        with self.lock:
+            if board_title in self.files and self._catch_up(board_title):
+                self._bump(board_title)
+                return True
+        return False
+
+    def close(self):
+        super().close() # Sync before the segments are closed
+        with self.lock:
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps = {}
+            for fd in self.files.values():
+                os.close(fd)
+            self.files = {}
+
+# One-shot copy of every board in a FileStorage tree into segments, oldest message first.
+# Boards that already have a non-empty segment are skipped so the migration can be re-run safely.
+def migrate(source_root, dest_root):
+    source = FileStorage(source_root)
+    dest = SegmentStorage(dest_root)
+    total = 0
+    for board_title in source.board_titles():
+        if not dest.has_board(board_title):
+            dest.create_board(board_title)
+        if len(dest.offsets[board_title]):
+            print(f"ERROR:\t\tSegment for {board_title} is not empty. Skipping.")
+            continue
+
+        file_names = source.board_index.messages[board_title]
+        for file_name in file_names:
+            try:
+                message_title, message = source.read(board_title, file_name)
+            except Exception as e:
+                print(f"ERROR:\tFailed to read file {source.board_list[board_title]}{file_name}")
+                print(e)
+                continue
+            stamp = time.mktime(time.strptime(file_name[:15], "%Y%m%d-%H%M%S"))
+            dest.append(board_title, message_title, message, stamp)
+        print(f"Migrated {len(file_names)} messages from {board_title}.")
+        total += len(file_names)
+    dest.close()
+    print(f"Done. Migrated {total} messages.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Board storage tools.")
+    subparsers = parser.add_subparsers(dest="tool", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Copy a board/ directory tree into segment files")
+    migrate_parser.add_argument("source", nargs='?', default="./board/", help="Board directory to read (default: ./board/)")
+    migrate_parser.add_argument("dest", nargs='?', default="./segments/", help="Segment directory to write (default: ./segments/)")
+    args = parser.parse_args()
+
+    if args.tool == "migrate":
+        if not os.path.isdir(args.source):
+            print(f"ERROR:\tBoard directory {args.source} does not exist.")
+            sys.exit(1)
+        migrate(args.source, args.dest)
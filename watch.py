@@ -0,0 +1,111 @@
+import os # For reading events and checking the directory
+import select # For waiting on inotify with a timeout
+import struct # For decoding inotify events
+import threading # For watching from a background thread
+import ctypes # For calling inotify in libc
+import ctypes.util
+
+# Watches the top level of a directory and calls on_change whenever entries appear in it or
+# disappear from it. Uses inotify where libc has it (Linux) and otherwise polls the directory's
+# modification time, which changes whenever an entry is added, removed or renamed.
+# on_change is called from the watcher thread and should rescan the directory itself, so events
+# only say that something changed and a burst of them costs a single rescan.
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII') # wd, mask, cookie, length of the name that follows
+
+# Returns libc if it provides inotify, else None
+def _load_inotify():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+class BoardWatcher:
+    def __init__(self, path, on_change, poll_interval=2.0, settle=0.05):
+        self.path = path # Directory to watch
+        self.on_change = on_change # Called after entries in path change
+        self.poll_interval = poll_interval # Seconds between checks when polling, and between stop checks otherwise
+        self.settle = settle # Seconds to wait for more events before calling on_change
+        self.stopped = threading.Event()
+        self.method = None # "inotify" or "poll" once started
+
+    # Start watching from a background thread
+    def start(self):
+        fd = self._inotify()
+        self.method = "poll" if fd is None else "inotify"
+        target = self._poll if fd is None else self._watch_inotify
+        threading.Thread(target=target, args=() if fd is None else (fd,), name="BoardWatcher", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    # Returns an inotify descriptor watching path, or None if inotify cannot be used
+    def _inotify(self):
+        libc = _load_inotify()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(self.path), IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO) < 0:
+            print(f"ERROR:\tFailed to watch {self.path}: {os.strerror(ctypes.get_errno())}. Polling instead.")
+            os.close(fd)
+            return None
+        return fd
+
+    # Drain every queued inotify event. Returns True if there were any.
+    def _drain(self, fd):
+        changed = False
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset + EVENT.size <= len(data):
+                _, _, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size + length # Names are not needed, on_change rescans
+                changed = True
+
+    def _watch_inotify(self, fd):
+        try:
+            while not self.stopped.is_set():
+                ready, _, _ = select.select([fd], [], [], self.poll_interval)
+                if not ready or not self._drain(fd):
+                    continue
+                # Let a burst of changes (a board and its files being copied in) finish first
+                while select.select([fd], [], [], self.settle)[0]:
+                    self._drain(fd)
+                self._changed()
+        finally:
+            os.close(fd)
+
+    def _poll(self):
+        last = self._mtime()
+        while not self.stopped.wait(self.poll_interval):
+            mtime = self._mtime()
+            if not mtime == last:
+                last = mtime
+                self._changed()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _changed(self):
+        try:
+            self.on_change()
+        except Exception as e:
+            print(f"ERROR:\tFailed to apply changes in {self.path}")
+            print(e)